@@ -0,0 +1,225 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Model benchmark.
+    ======================
+    Measures how fast a detection model runs on the current machine, without any camera.
+    Each case loads the model in a fresh process: cold start, warm latency percentiles, throughput and peak memory above
+    the process baseline are reported as JSON so that model versions and machines can be compared.
+
+    Usage:
+        benchmark_model.py [--backend tensorflow --model-path training/outputs/frozen_inference_graph.pb
+                            --qualities sd hd full-hd --batch-sizes 1 4 8 --threads 1 4 --images synthetic dataset
+                            --iterations 20 --warmup 3 --output training/outputs/benchmark.json]
+
+    Options:
+        backend (str): Inference backend.
+        model-path (str): Model path, the backend configured path by default.
+        qualities (str): Input resolutions.
+        batch-sizes (int): Number of frames processed at once.
+        threads (int): Number of intra-op threads.
+        images (str): 'synthetic' noise frames and/or 'dataset' images resized to each resolution.
+        iterations (int): Timed batches per case.
+        warmup (int): Untimed batches run before timing.
+        output (str): Output report file.
+"""
+
+import json
+import time
+import platform
+import resource
+
+from utils import *
+from config import *
+from argparse import ArgumentParser
+from multiprocessing import Process, Queue
+from metrics_utils import PERCENTILES
+from model_utils import BACKENDS, create_model, load_sample_images
+
+__description__ = "Measures how fast a detection model runs on the current machine."
+
+# Available image kinds.
+IMAGE_KINDS = ("synthetic", "dataset")
+
+# Parse args.
+parser = ArgumentParser(description=__description__)
+
+parser.add_argument("--backend", dest="backend",
+                    type=str,
+                    choices=list(BACKENDS.keys()),
+                    default=DETECTION_CONFIG["backend"],
+                    help="Inference backend, default is {default}.".format(default=DETECTION_CONFIG["backend"]))
+
+parser.add_argument("-m", "--model-path", dest="model_path",
+                    type=str,
+                    default=None,
+                    help="Model path, default is the backend configured path.")
+
+parser.add_argument("-q", "--qualities", dest="qualities",
+                    type=str,
+                    nargs="+",
+                    choices=list(INPUT_RESOLUTION.keys()),
+                    default=list(INPUT_RESOLUTION.keys()),
+                    help="Input resolutions, default is {default}.".format(default=list(INPUT_RESOLUTION.keys())))
+
+parser.add_argument("-b-sizes", "--batch-sizes", dest="batch_sizes",
+                    type=int,
+                    nargs="+",
+                    default=DETECTION_CONFIG["benchmark"]["batch_sizes"],
+                    help="Number of frames processed at once, default is {default}.".format(
+                        default=DETECTION_CONFIG["benchmark"]["batch_sizes"]))
+
+parser.add_argument("-t", "--threads", dest="threads",
+                    type=int,
+                    nargs="+",
+                    default=sorted({1, len(get_available_cores())}),
+                    help="Number of intra-op threads, default is {default}.".format(
+                        default=sorted({1, len(get_available_cores())})))
+
+parser.add_argument("-i", "--images", dest="images",
+                    type=str,
+                    nargs="+",
+                    choices=IMAGE_KINDS,
+                    default=list(IMAGE_KINDS),
+                    help="Synthetic noise frames and/or dataset images, default is {default}.".format(
+                        default=list(IMAGE_KINDS)))
+
+parser.add_argument("-n", "--iterations", dest="iterations",
+                    type=int,
+                    default=DETECTION_CONFIG["benchmark"]["iterations"],
+                    help="Timed batches per case, default is {default}.".format(
+                        default=DETECTION_CONFIG["benchmark"]["iterations"]))
+
+parser.add_argument("-w", "--warmup", dest="warmup",
+                    type=int,
+                    default=DETECTION_CONFIG["benchmark"]["warmup"],
+                    help="Untimed batches run before timing, default is {default}.".format(
+                        default=DETECTION_CONFIG["benchmark"]["warmup"]))
+
+parser.add_argument("-o", "--output", dest="output",
+                    type=str,
+                    default=DETECTION_CONFIG["benchmark"]["output"],
+                    help="Output report file, default is {default}.".format(
+                        default=DETECTION_CONFIG["benchmark"]["output"]))
+
+args = parser.parse_args()
+
+
+def get_images(kind, width, height, count):
+    """
+    Builds benchmark images.
+    :param kind: 'synthetic' or 'dataset'.
+    :param width: images width.
+    :param height: images height.
+    :param count: number of images.
+    :return: list of images, empty if the dataset has no image.
+    """
+    if kind == "synthetic":
+        return [np.random.randint(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(count)]
+    return load_sample_images(count=count, size=(width, height))
+
+
+def measure_case(case):
+    """
+    Measures a case.
+    :param case: quality, batch size, threads and images kind.
+    :return: case report.
+    """
+    width, height = INPUT_RESOLUTION[case["quality"]]["width"], INPUT_RESOLUTION[case["quality"]]["height"]
+    images = get_images(case["images"], width, height, case["batch_size"])
+    if not images:
+        return dict(case, error="No images in {dir}.".format(dir=ROIS_PATH))
+
+    # A single batch is reused by every iteration, images are repeated if the dataset is smaller than the batch.
+    batch = np.stack([images[i % len(images)] for i in range(case["batch_size"])])
+
+    # Memory is reported relative to the process before the model is loaded. Kilobytes on Linux.
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    # Cold start covers the runtime import, the model loading and the first batch.
+    start = time.time()
+    model = create_model(args.backend, path=args.model_path, intra_op_threads=case["threads"], inter_op_threads=1)
+    loaded = time.time()
+    model.detect(batch)
+    cold_start = time.time() - start
+
+    for _ in range(1, args.warmup):
+        model.detect(batch)
+
+    latencies = []
+    for _ in range(args.iterations):
+        begin = time.time()
+        model.detect(batch)
+        latencies.append(time.time() - begin)
+    model.close()
+
+    latencies = np.array(latencies)
+    return dict(case, **{
+        "load": loaded - start,
+        "cold_start": cold_start,
+        "latency": dict({"p{p}".format(p=p): float(np.percentile(latencies, p)) for p in PERCENTILES},
+                        mean=float(latencies.mean())),
+        "throughput": case["batch_size"] * len(latencies) / float(latencies.sum()),
+        "baseline_rss": baseline_rss,
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - baseline_rss
+    })
+
+
+def run_case(case, report_q):
+    """
+    Measures a case, runs in its own process so that cold start and peak memory only depend on the case.
+    :param case: quality, batch size, threads and images kind.
+    :param report_q: queue receiving the report, an error report if the case failed.
+    :return: void.
+    """
+    try:
+        report_q.put(measure_case(case))
+    except Exception as ee:
+        report_q.put(dict(case, error=str(ee)))
+
+
+def main():
+    """
+    Main program.
+    :return: void.
+    """
+    cases = [{"quality": quality, "batch_size": batch_size, "threads": threads, "images": images}
+             for quality in args.qualities for batch_size in args.batch_sizes for threads in args.threads
+             for images in args.images]
+
+    print("{:<10}{:>7}{:>9}{:>11}{:>12}{:>10}{:>10}{:>10}{:>16}".format(
+        "Quality", "Batch", "Threads", "Images", "Cold (s)", "p50 (ms)", "p95 (ms)", "FPS", "Peak RSS (MB)"))
+
+    reports = []
+    for case in cases:
+        report_q = Queue()
+        process = Process(target=run_case, args=(case, report_q))
+        process.start()
+        report = wait_report(process, report_q, case)
+        process.join()
+        reports.append(report)
+
+        if "error" in report:
+            print("{quality:<10}{batch_size:>7}{threads:>9}{images:>11}  {error}".format(**report))
+            continue
+        print("{:<10}{:>7}{:>9}{:>11}{:>12.2f}{:>10.1f}{:>10.1f}{:>10.1f}{:>16.1f}".format(
+            report["quality"], report["batch_size"], report["threads"], report["images"], report["cold_start"],
+            report["latency"]["p50"] * 1000, report["latency"]["p95"] * 1000, report["throughput"],
+            report["peak_rss"] / 2 ** 20))
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "backend": args.backend,
+            "model": args.model_path or DETECTION_CONFIG["backends"][args.backend]["path"],
+            "machine": {"platform": platform.platform(), "processor": platform.processor(),
+                        "cores": len(get_available_cores())},
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "reports": reports
+        }, f, indent=2)
+    print("Report saved in {output}.".format(output=args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,9 +6,77 @@
     Collection of useful functions for webcam detection.
 """
 
+import time
+
 from utils import *
 from config import *
-from threading import Thread
+from threading import Condition, Thread
+from collections import deque, namedtuple
+
+# Available resize modes.
+RESIZE_MODES = ('stretch', 'letterbox')
+
+# Available video source kinds, see parse_source.
+SOURCE_KINDS = ('device', 'replay', 'file', 'synthetic')
+
+# Frame read from a stream, seq increases by one with each frame and timestamp is the capture time.
+CapturedFrame = namedtuple('CapturedFrame', ['seq', 'timestamp', 'frame', 'resized'])
+
+
+def parse_size(value):
+    """
+    Parses a frame size written as WIDTHxHEIGHT.
+    :param value: size as string.
+    :return: size as (width, height).
+    """
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def letterbox_params(shape, size):
+    """
+    Computes where a frame lands once letterboxed in the specified size.
+    :param shape: source frame shape.
+    :param size: target size as (width, height).
+    :return: target height, target width, top padding, left padding, content height and content width.
+    """
+    height, width = shape[:2]
+    target_width, target_height = size
+    ratio = min(target_width / width, target_height / height)
+    content_width, content_height = int(round(width * ratio)), int(round(height * ratio))
+    return (target_height, target_width, (target_height - content_height) // 2, (target_width - content_width) // 2,
+            content_height, content_width)
+
+
+def resize_frame(frame, size, mode='stretch'):
+    """
+    Resizes a frame to the inference size.
+    :param frame: input frame.
+    :param size: target size as (width, height).
+    :param mode: 'stretch' ignores the aspect ratio, 'letterbox' keeps it and pads with black borders.
+    :return: resized frame.
+    """
+    if mode == 'stretch':
+        return cv.resize(frame, tuple(size), interpolation=cv.INTER_AREA)
+
+    target_height, target_width, top, left, content_height, content_width = letterbox_params(frame.shape, size)
+    output = np.zeros((target_height, target_width) + frame.shape[2:], dtype=frame.dtype)
+    output[top:top + content_height, left:left + content_width] = cv.resize(frame, (content_width, content_height),
+                                                                            interpolation=cv.INTER_AREA)
+    return output
+
+
+def restore_boxes(boxes, params):
+    """
+    Maps normalized boxes detected on a letterboxed frame back to the source frame.
+    :param boxes: normalized boxes as (ymin, xmin, ymax, xmax).
+    :param params: letterbox parameters, see letterbox_params.
+    :return: normalized boxes on the source frame.
+    """
+    target_height, target_width, top, left, content_height, content_width = params
+    scale = np.array([target_height / content_height, target_width / content_width] * 2, dtype=np.float32)
+    offset = np.array([top / content_height, left / content_width] * 2, dtype=np.float32)
+    return np.clip(boxes * scale - offset, 0, 1)
 
 
 class FPS:
@@ -65,21 +133,80 @@ class FPS:
 class WebcamVideoStream:
     """
     Class to retrieve the videostream of a capture device frame per frame.
+    Each frame gets a sequence id and a capture timestamp, readers may wait for a frame newer than the one they had.
     """
 
-    def __init__(self, src, width, height):
+    def __init__(self, src, width, height, cores=None, inference_size=None, resize_mode='stretch',
+                 history=DEVICE_CONFIG['history']):
         """
         # Initializes the video camera stream and read the first frame from the stream.
         :param src: capture device identifier.
         :param width: width.
         :param height: height.
+        :param cores: cores the capture Thread is pinned to, not pinned if not set.
+        :param inference_size: size (width, height) frames are also resized to, not resized if not set.
+        :param resize_mode: 'stretch' or 'letterbox'.
+        :param history: number of recent frames kept.
+        """
+        self.cores = cores
+        self.inference_size = inference_size
+        self.resize_mode = resize_mode
+        self.open(src, width, height)
+
+        self.condition = Condition()
+        self.history = deque(maxlen=history)
+        self.last_read = -1
+        self.seq = -1
+        self.stopped = False
+        self.failures = 0
+
+        (grabbed, frame) = self.grab()
+        if not grabbed:
+            raise IOError('Unable to read from video source {src}.'.format(src=src))
+        self.store(frame)
+
+    def open(self, src, width, height):
+        """
+        Opens the capture device.
+        :param src: capture device identifier.
+        :param width: width.
+        :param height: height.
+        :return: void.
         """
         self.stream = cv.VideoCapture(src)
         self.stream.set(get_prop_id("FRAME_WIDTH"), width)
         self.stream.set(get_prop_id("FRAME_HEIGHT"), height)
 
-        (self.grabbed, self.frame) = self.stream.read()
-        self.stopped = False
+    def grab(self):
+        """
+        Reads the next frame from the stream.
+        :return: whether a frame was read and the frame.
+        """
+        return self.stream.read()
+
+    def store(self, frame):
+        """
+        Publishes a new frame and wakes the readers up.
+        :param frame: frame.
+        :return: void.
+        """
+        # Resize out of the lock, readers only wait for the swap.
+        timestamp = time.time()
+        resized = self.resize(frame)
+
+        with self.condition:
+            self.seq += 1
+            self.latest = CapturedFrame(self.seq, timestamp, frame, resized)
+            self.history.append(self.latest)
+            self.condition.notify_all()
+
+    @property
+    def frame(self):
+        """
+        Returns the frame the most recently read, at capture size.
+        :return: frame.
+        """
+        return self.latest.frame
 
     def start(self):
         """
@@ -94,12 +221,38 @@ class WebcamVideoStream:
         Keeps looping infinitely until the Thread is stopped.
         :return: void.
         """
+        set_cpu_affinity(self.cores)
+
         while True:
             if self.stopped:
                 return
 
-            # Read the next frame from the stream.
-            (self.grabbed, self.frame) = self.stream.read()
+            # Read the next frame from the stream, both sizes are swapped at once.
+            (grabbed, frame) = self.grab()
+            if grabbed:
+                self.failures = 0
+                self.store(frame)
+                continue
+            if self.stopped:
+                return
+
+            # Failed reads aren't published, the stream stops once the source looks gone for good.
+            self.failures += 1
+            if self.failures >= DEVICE_CONFIG['max_failed_reads']:
+                print("No frame read in {count} attempts, stopping the videostream.".format(count=self.failures))
+                self.stop()
+                return
+            time.sleep(DEVICE_CONFIG['failed_read_delay'])
+
+    def resize(self, frame):
+        """
+        Resizes a frame to the inference size.
+        :param frame: captured frame.
+        :return: resized frame, None if frames are not resized.
+        """
+        if self.inference_size is None or frame is None:
+            return None
+        return resize_frame(frame, self.inference_size, self.resize_mode)
 
     def read(self):
         """
@@ -108,9 +261,239 @@ class WebcamVideoStream:
         """
         return self.frame
 
+    def read_resized(self):
+        """
+        Returns the frame the most recently read at both capture and inference sizes.
+        :return: frame, resized frame or the same frame if frames are not resized.
+        """
+        latest = self.latest
+        return latest.frame, latest.frame if latest.resized is None else latest.resized
+
+    def read_new(self, timeout=None, after=None):
+        """
+        Waits for a frame newer than a given one, so that the same frame is never read twice.
+        :param timeout: maximum time (s) to wait, waits forever if not set.
+        :param after: sequence id of the last frame read, the last one returned by read_new if not set.
+        :return: captured frame, its resized frame is the frame itself if frames are not resized, None on timeout or
+        once the stream is stopped.
+        """
+        after = self.last_read if after is None else after
+
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > after or self.stopped, timeout) or self.seq <= after:
+                return None
+            latest = self.latest
+            self.last_read = latest.seq
+            self.condition.notify_all()
+
+        return latest if latest.resized is not None else latest._replace(resized=latest.frame)
+
+    def recent(self):
+        """
+        Returns the most recent frames, oldest first.
+        :return: list of captured frames.
+        """
+        with self.condition:
+            return list(self.history)
+
     def stop(self):
         """
         Indicates that the Thread should be stopped.
         :return: void.
         """
-        self.stopped = True
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+
+class PacedVideoStream(WebcamVideoStream):
+    """
+    Base class of the streams which produce frames themselves at a fixed framerate, in place of a capture device.
+    """
+
+    def __init__(self, src, width, height, cores=None, inference_size=None, resize_mode='stretch',
+                 fps=DEVICE_CONFIG['fps'], history=DEVICE_CONFIG['history']):
+        """
+        Initializes the stream and produces the first frame.
+        :param src: source identifier.
+        :param width: frames width.
+        :param height: frames height.
+        :param cores: cores the capture Thread is pinned to, not pinned if not set.
+        :param inference_size: size (width, height) frames are also resized to, not resized if not set.
+        :param resize_mode: 'stretch' or 'letterbox'.
+        :param fps: framerate, frames are produced as fast as possible if 0, at the source framerate if None.
+        :param history: number of recent frames kept.
+        """
+        self.interval = None if fps is None else 1 / fps if fps else 0
+        self.next_time = None
+        self.count = 0
+        WebcamVideoStream.__init__(self, src, width, height, cores=cores, inference_size=inference_size,
+                                   resize_mode=resize_mode, history=history)
+
+    def grab(self):
+        """
+        Waits for the next frame time then produces a frame.
+        Streams without framerate wait for the previous frame to be read by read_new instead, so that every frame
+        reaches the reader.
+        :return: whether a frame was produced and the frame.
+        """
+        if not self.interval:
+            with self.condition:
+                self.condition.wait_for(lambda: self.last_read >= self.seq or self.stopped)
+
+        now = time.time()
+        if self.next_time is not None and now < self.next_time:
+            time.sleep(self.next_time - now)
+
+        # Late frames don't accumulate, the stream skips them like a device would.
+        self.next_time = max(self.next_time or now, time.time() - self.interval) + self.interval
+        self.count += 1
+        return self.produce()
+
+    def produce(self):
+        """
+        Produces the next frame.
+        :return: whether a frame was produced and the frame.
+        """
+        raise NotImplementedError
+
+
+class SyntheticVideoStream(PacedVideoStream):
+    """
+    Class to generate frames of boxes moving over a noisy background, the source identifier seeds the generator.
+    """
+
+    def open(self, src, width, height):
+        """
+        Draws the background and the initial boxes.
+        :param src: random seed.
+        :param width: frames width.
+        :param height: frames height.
+        :return: void.
+        """
+        if self.interval is None:
+            self.interval = 1 / DEVICE_CONFIG['fps']
+
+        rng = np.random.RandomState(src)
+        self.background = rng.randint(0, 256, (height, width, 3)).astype(np.uint8)
+
+        # Boxes as (x, y, width, height), moving by (dx, dy) pixels per frame.
+        num_boxes = 3
+        sizes = rng.uniform(.1, .3, (num_boxes, 2)) * [width, height]
+        self.boxes = np.hstack([rng.uniform(0, 1, (num_boxes, 2)) * ([width, height] - sizes), sizes])
+        self.speeds = rng.uniform(-.01, .01, (num_boxes, 2)) * [width, height]
+        self.colors = [tuple(int(c) for c in color) for color in rng.randint(0, 256, (num_boxes, 3))]
+
+    def produce(self):
+        """
+        Moves the boxes, bouncing on the frame borders, and draws them.
+        :return: whether a frame was produced and the frame.
+        """
+        height, width = self.background.shape[:2]
+        self.boxes[:, :2] += self.speeds
+        limits = np.array([width, height]) - self.boxes[:, 2:]
+        bounced = (self.boxes[:, :2] < 0) | (self.boxes[:, :2] > limits)
+        self.speeds[bounced] *= -1
+        self.boxes[:, :2] = np.clip(self.boxes[:, :2], 0, limits)
+
+        frame = self.background.copy()
+        for (x, y, w, h), color in zip(self.boxes.astype(int), self.colors):
+            cv.rectangle(frame, (x, y), (x + w, y + h), color, -1)
+        return True, frame
+
+
+class ReplayVideoStream(PacedVideoStream):
+    """
+    Class to replay a recorded video, frames are resized to the requested size.
+    Frames are paced at the recorded framerate by default, or read as fast as possible with a framerate of 0.
+    """
+
+    def __init__(self, src, width, height, loop=True, **options):
+        """
+        Opens the video file and reads the first frame.
+        :param src: video file path.
+        :param width: frames width.
+        :param height: frames height.
+        :param loop: whether the video starts over once it ends, the stream stops at the end otherwise.
+        :param options: other PacedVideoStream options.
+        """
+        self.loop = loop
+        PacedVideoStream.__init__(self, src, width, height, **options)
+
+    def open(self, src, width, height):
+        """
+        Opens the video file.
+        :param src: video file path.
+        :param width: frames width.
+        :param height: frames height.
+        :return: void.
+        """
+        self.stream = cv.VideoCapture(src)
+        self.size = (width, height)
+        if not self.stream.isOpened():
+            raise IOError('Unable to open {path}.'.format(path=src))
+
+        # Replay at the recorded framerate, some containers don't store it.
+        if self.interval is None:
+            rate = self.stream.get(cv.CAP_PROP_FPS)
+            self.interval = 1 / (rate if rate > 0 else DEVICE_CONFIG['fps'])
+
+    def produce(self):
+        """
+        Reads the next frame, the video starts over or the stream stops once it ends.
+        :return: whether a frame was read and the frame.
+        """
+        (grabbed, frame) = self.stream.read()
+        if not grabbed and not self.loop:
+            self.stop()
+            return grabbed, frame
+        if not grabbed:
+            self.stream.set(cv.CAP_PROP_POS_FRAMES, 0)
+            (grabbed, frame) = self.stream.read()
+
+        if grabbed and frame.shape[1::-1] != self.size:
+            frame = cv.resize(frame, self.size, interpolation=cv.INTER_AREA)
+        return grabbed, frame
+
+
+def parse_source(spec):
+    """
+    Parses a video source.
+    :param spec: capture device ID or 'device:ID', 'replay:path' to replay a video in real time in a loop,
+    'file:path' to read it once as fast as possible, each frame waiting for the previous one to be read,
+    'synthetic:seed' for generated frames of moving boxes, any other value is opened by OpenCV as a device (URL,
+    GStreamer pipeline...). Paced sources take an optional '@FPS' suffix.
+    :return: source kind, see SOURCE_KINDS, target and framerate, None for the default one.
+    """
+    spec = str(spec)
+    kind, _, target = spec.partition(':')
+    if kind not in SOURCE_KINDS:
+        return 'device', int(spec) if spec.isdigit() else spec, None
+    if kind == 'device':
+        return kind, int(target) if target.isdigit() else target, None
+
+    fps = None
+    head, _, tail = target.rpartition('@')
+    if head and tail.replace('.', '', 1).isdigit():
+        target, fps = head, float(tail)
+    if kind == 'synthetic':
+        target = int(target or 0)
+    return kind, target, fps if kind != 'file' else 0
+
+
+def open_stream(spec, width, height, **options):
+    """
+    Creates the videostream of a video source.
+    :param spec: video source, see parse_source.
+    :param width: frames width.
+    :param height: frames height.
+    :param options: other WebcamVideoStream options.
+    :return: stream, to be started.
+    """
+    kind, target, fps = parse_source(spec)
+
+    if kind == 'device':
+        return WebcamVideoStream(target, width, height, **options)
+    elif kind == 'synthetic':
+        return SyntheticVideoStream(target, width, height, fps=fps, **options)
+    return ReplayVideoStream(target, width, height, fps=fps, loop=kind == 'replay', **options)
@@ -5,19 +5,22 @@
     Videostream capture.
     ======================
 
-    Displays in real-time the videostream of any recording plugged device.
+    Displays in real-time the videostream of any recording plugged device, video file or synthetic source.
 
     Usage:
         capture_videostream.py [--video-source 0 --quality hd]
 
     Options:
-        video-source (int): Capture device ID.
+        video-source (str): Capture device ID, 'replay:path' to replay a video in real time in a loop, 'file:path'
+                            to read it once as fast as it is displayed or 'synthetic:seed' for generated moving boxes,
+                            paced sources take an optional '@FPS' suffix.
         quality (str): Input quality.
 """
 
 from utils import *
 from config import *
 from argparse import ArgumentParser
+from cam_utils import open_stream
 
 __description__ = "Displays in real-time the videostream of any recording plugged device."
 
@@ -25,9 +28,10 @@ __description__ = "Displays in real-time the videostream of any recording plugge
 parser = ArgumentParser(description=__description__)
 
 parser.add_argument("-v-source", "--video-source", dest="video_source",
-                    type=int,
-                    default=DEVICE_CONFIG["id"],
-                    help="Capture device identifier, default is {default}.".format(default=DEVICE_CONFIG["id"]))
+                    type=str,
+                    default=str(DEVICE_CONFIG["id"]),
+                    help="Video source, device ID, 'replay:path', 'file:path' or 'synthetic:seed', default is "
+                         "{default}.".format(default=DEVICE_CONFIG["id"]))
 
 parser.add_argument("-q", "--quality", dest="quality",
                     type=str,
@@ -43,37 +47,38 @@ def main():
     :return: void.
     """
 
-    # Get the first video input.
+    # Get the video input.
+    stream = None
     try:
-        # Retrieve video input.
-        cap = cv.VideoCapture(args.video_source)
-
         width, height = INPUT_RESOLUTION[args.quality]["width"], INPUT_RESOLUTION[args.quality]["height"]
 
-        # Set input properties.
-        cap.set(get_prop_id("FRAME_WIDTH"), width)
-        cap.set(get_prop_id("FRAME_HEIGHT"), height)
+        # Retrieve video input, read by its own Thread.
+        stream = open_stream(args.video_source, width, height).start()
 
         while True:
-            # Capture frame-by-frame.
-            ret, frame = cap.read()
+            # Wait for the next frame, slow sources may take longer than the timeout.
+            captured = stream.read_new(timeout=1)
+            if captured is None:
+                # The source failed.
+                if stream.stopped:
+                    break
+                continue
 
-            if ret:
-                # Display the frame.
-                cv.imshow("Webcam videostream ({width} x {height})".format(width=width, height=height), frame)
+            # Display the frame.
+            cv.imshow("Webcam videostream ({width} x {height})".format(width=width, height=height), captured.frame)
 
-                # Exit program on the Q click.
-                if cv.waitKey(1) & 0xFF == ord('q'):
-                    break
-            else:
+            # Exit program on the Q click.
+            if cv.waitKey(1) & 0xFF == ord('q'):
                 break
 
-        # Release capture and close windows.
-        cap.release()
-        cv.destroyAllWindows()
-
     except Exception as ee:
-        print("Device {device} not found : {error}.".format(device=args.device, error=ee))
+        print("Source {source} not found : {error}.".format(source=args.video_source, error=ee))
+
+    finally:
+        # Release capture and close windows, the capture Thread would keep the program alive otherwise.
+        if stream is not None:
+            stream.stop()
+        cv.destroyAllWindows()
 
 
 if __name__ == "__main__":
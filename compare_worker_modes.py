@@ -0,0 +1,160 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Worker modes comparison.
+    ======================
+    Compares the memory and throughput of the process and thread worker modes on synthetic frames.
+
+    Usage:
+        compare_worker_modes.py [--quality hd --num-workers 4 --batch-size 1 --duration 30]
+
+    Options:
+        quality (str): Frames resolution.
+        num-workers (int): Number of workers.
+        batch-size (int): Number of frames processed at once by a worker.
+        duration (int): Measurement duration (s) of each mode.
+"""
+
+import json
+import time
+
+from utils import *
+from config import *
+from queue import Empty
+from threading import Thread
+from argparse import ArgumentParser
+from queue import Queue as LocalQueue
+from multiprocessing import Process, Queue
+from pipeline_utils import WORKER_MODES, FrameRing, FrameTask, start_workers
+
+__description__ = "Compares the memory and throughput of the process and thread worker modes."
+
+# Parse args.
+parser = ArgumentParser(description=__description__)
+
+parser.add_argument("-q", "--quality", dest="quality",
+                    type=str,
+                    choices=list(INPUT_RESOLUTION.keys()),
+                    default=DEVICE_CONFIG["resolution"],
+                    help="Frames resolution, default is {default}.".format(default=DEVICE_CONFIG["resolution"]))
+
+parser.add_argument('-num-w', '--num-workers', dest='num_workers',
+                    type=int,
+                    default=DETECTION_CONFIG["num_workers"],
+                    help='Number of workers, default is {default}.'.format(default=DETECTION_CONFIG["num_workers"]))
+
+parser.add_argument("-b-size", "--batch-size", dest="batch_size",
+                    type=int,
+                    default=DETECTION_CONFIG["batch_size"],
+                    help="Number of frames processed at once by a worker, default is {default}.".format(
+                        default=DETECTION_CONFIG["batch_size"]))
+
+parser.add_argument("-d", "--duration", dest="duration",
+                    type=int,
+                    default=30,
+                    help="Measurement duration (s) of each mode, default is {default}.".format(default=30))
+
+parser.add_argument("-o", "--output", dest="output",
+                    type=str,
+                    default=os.path.join(OUTPUTS_DIR, 'worker_modes.json'),
+                    help="Output report file, default is {default}.".format(
+                        default=os.path.join(OUTPUTS_DIR, 'worker_modes.json')))
+
+args = parser.parse_args()
+
+
+def run_mode(mode, report_q):
+    """
+    Measures a worker mode, runs in its own process so that modes don't share memory.
+    :param mode: worker mode.
+    :param report_q: queue receiving the report.
+    :return: void.
+    """
+    width, height = INPUT_RESOLUTION[args.quality]["width"], INPUT_RESOLUTION[args.quality]["height"]
+    queue_size = args.num_workers * args.batch_size * 2
+
+    # Slots are filled once, frames content doesn't matter.
+    frame_ring = FrameRing(queue_size * 2, (height, width, 3))
+    for slot in range(frame_ring.num_slots):
+        frame_ring.write(slot, np.random.randint(0, 256, frame_ring.shape, dtype=np.uint8))
+
+    queue_type = Queue if mode == 'process' else LocalQueue
+    input_q, output_q = queue_type(maxsize=queue_size), queue_type(maxsize=queue_size)
+
+    started = time.time()
+    pool = start_workers(mode, args.num_workers, input_q, output_q, [frame_ring], batch_size=args.batch_size)
+
+    report = {'mode': mode, 'frames': 0, 'peak_memory': 0}
+
+    def consume():
+        """
+        Counts processed frames once every worker answered, and samples memory.
+        :return: void.
+        """
+        sampled = 0
+        while True:
+            try:
+                result = output_q.get(timeout=1)
+            except Empty:
+                continue
+            now = time.time()
+            frame_ring.release(result.slot)
+
+            if 'ready' not in report:
+                # First result includes model loading.
+                report['ready'] = now
+                report['startup'] = now - started
+            else:
+                report['frames'] += 1
+                report['last'] = now
+
+            if now - sampled > .5:
+                report['peak_memory'] = max(report['peak_memory'], memory_usage())
+                sampled = now
+
+    Thread(target=consume, daemon=True).start()
+
+    seq = 0
+    while 'ready' not in report or time.time() - report['ready'] < args.duration:
+        slot = frame_ring.acquire()
+        input_q.put(FrameTask(0, seq, time.time(), time.time(), slot))
+        seq += 1
+
+    report['fps'] = report['frames'] / (report.get('last', report['ready']) - report['ready'] or 1)
+    report_q.put({key: value for key, value in report.items() if key not in ('ready', 'last')})
+
+    if pool is not None:
+        pool.terminate()
+
+
+def main():
+    """
+    Main program.
+    :return: void.
+    """
+    reports = []
+    for mode in WORKER_MODES:
+        print("Measuring {mode} mode for {duration}s...".format(mode=mode, duration=args.duration))
+        report_q = Queue()
+        process = Process(target=run_mode, args=(mode, report_q))
+        process.start()
+        reports.append(wait_report(process, report_q, {'mode': mode}))
+        process.join()
+
+    print("{:<10}{:>12}{:>12}{:>16}".format("Mode", "Startup (s)", "FPS", "Peak mem (MB)"))
+    for report in reports:
+        if 'error' in report:
+            print("{mode:<10}  {error}".format(**report))
+            continue
+        print("{:<10}{:>12.1f}{:>12.1f}{:>16.1f}".format(
+            report['mode'], report['startup'], report['fps'], report['peak_memory'] / 2 ** 20))
+
+    with open(args.output, 'w') as f:
+        json.dump({'quality': args.quality, 'num_workers': args.num_workers, 'batch_size': args.batch_size,
+                   'reports': reports}, f, indent=2)
+    print("Report saved in {output}.".format(output=args.output))
+
+
+if __name__ == "__main__":
+    main()
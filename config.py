@@ -52,6 +52,10 @@ TUNE_CHECKPOINTS_DIR = os.path.join(TRAINING_DIR, 'tune_checkpoints')
 CHECKPOINTS_DIR = os.path.join(TRAINING_DIR, 'checkpoints')
 OUTPUTS_DIR = os.path.join(TRAINING_DIR, 'outputs')
 FROZEN_MODEL_PATH = os.path.join(OUTPUTS_DIR, 'frozen_inference_graph.pb')
+TFLITE_MODEL_PATH = os.path.join(OUTPUTS_DIR, 'detect.tflite')
+DNN_CONFIG_PATH = os.path.join(OUTPUTS_DIR, 'frozen_inference_graph.pbtxt')
+OPTIMIZED_MODEL_PATH = os.path.join(OUTPUTS_DIR, 'optimized_inference_graph.pb')
+INFERENCE_SERVER_ADDRESS = 'unix:' + os.path.join(OUTPUTS_DIR, 'inference.sock')
 
 # Time configuration.
 TIMEZONE = 'Europe/Paris'
@@ -78,6 +82,13 @@ TEST_RATIO = 15
 DEVICE_CONFIG = {
     'id': 0,
     'resolution': 'hd',
+    # Framerate of the synthetic sources and of the recordings which don't store theirs.
+    'fps': 30,
+    # Number of recent frames kept by a videostream.
+    'history': 8,
+    # Consecutive failed reads after which a videostream stops, and delay (s) between them.
+    'max_failed_reads': 50,
+    'failed_read_delay': .1
 }
 
 # Available capture resolutions.
@@ -165,14 +176,179 @@ ROI_CONFIG = {
 
 # Items detection settings.
 DETECTION_CONFIG = {
+    # 'process' loads one model per worker process, 'thread' shares one model between worker threads.
+    'worker_mode': 'process',
     'num_workers': 4,
     'queue_size': 8,
+    # What happens when the workers fall behind: 'block' the capture, 'drop-oldest' queued frame or only keep the
+    # 'latest' frame.
+    'admission_policy': 'block',
+    # Size (width, height) frames are resized to in the capture Thread before inference, None keeps the capture size.
+    'inference_size': None,
+    # How frames are fitted to the inference size, 'stretch' or 'letterbox' to keep the aspect ratio.
+    'resize_mode': 'stretch',
+    # Number of frames a worker gathers before running the model, 1 disables batching.
+    'batch_size': 1,
+    # Maximum time (ms) a worker waits to fill a batch.
+    'batch_timeout': 10,
+    # Maximum age (ms) of a frame waiting for an earlier one before giving up on the missing frames.
+    'reorder_deadline': 250,
+    # Number of frames waiting to be displayed, older frames are dropped when the display is too slow.
+    'display_queue_size': 2,
+    # Maximum time (s) to wait for the last frames to come out of the pipeline once every video source ended.
+    'drain_timeout': 10,
+    # CPU allocation, unset values are derived from the available cores and the number of workers.
+    'cpu': {
+        # Cores used by the pipeline, all available cores by default.
+        'cores': None,
+        # Threads used by a session to run a single operation.
+        'intra_op_threads': None,
+        # Threads used by a session to run independent operations.
+        'inter_op_threads': None,
+        # Pin each worker and the capture thread to disjoint cores.
+        'pin': False
+    },
+    # Motion gating, unchanged frames reuse the last detections instead of running the model.
+    'motion': {
+        'enabled': False,
+        # Size frames are downscaled to before being compared.
+        'width': 160,
+        'height': 90,
+        # Minimum grey level difference for a pixel to be considered changed.
+        'threshold': 25,
+        # Minimum ratio of changed pixels for a frame to be considered changed.
+        'min_area': .005,
+        # Maximum number of consecutive skipped frames, forces a refresh on slow changes such as lighting.
+        'max_skipped': 150
+    },
+    # Detection scheduling, frames between two detections get the last boxes moved along the optical flow.
+    'tracking': {
+        'enabled': False,
+        # Run the model on one frame out of detect_every.
+        'detect_every': 5,
+        # Also run the model when the last detection is older than this interval (s), 0 disables it.
+        'detect_interval': 0,
+        # Width frames are downscaled to before computing the optical flow.
+        'width': 320,
+        # Number of points tracked per box side.
+        'grid': 4
+    },
+    # Where detections are written in headless mode, 'jsonl:path/to/file.jsonl' or 'unix:path/to/socket'.
+    'sink': 'jsonl:' + os.path.join(OUTPUTS_DIR, 'detections.jsonl'),
+    # Unix socket sink: maximum time (s) a send may block and reconnection delays (s), doubled after each failure.
+    'socket_sink': {
+        'send_timeout': .05,
+        'retry_min': .5,
+        'retry_max': 30
+    },
+    # Columnar detections file written by offline video detection.
+    'video_output': os.path.join(OUTPUTS_DIR, 'video_detections.npz'),
+    # Number of decoded frames buffered ahead of inference when reading video files.
+    'decode_queue_size': 32,
+    # Frame ranges per worker videos are split into, more ranges balance the load better.
+    'video_segments_per_worker': 4,
+    # Rolling window (s) of the reported framerate and latency percentiles.
+    'metrics_window': 10,
+    # Local HTTP port serving metrics in the Prometheus text format, 0 disables the endpoint.
+    'metrics_port': 0,
+    # File where metrics are dumped on exit.
+    'metrics_path': os.path.join(OUTPUTS_DIR, 'metrics.json'),
+    # Inference backend, 'tensorflow' frozen graph, 'tflite' interpreter or 'opencv' DNN module.
+    'backend': 'tensorflow',
+    # Number of detections returned per frame by every backend, as produced by the frozen graph.
+    'max_detections': 100,
+    'backends': {
+        'tensorflow': {
+            'path': FROZEN_MODEL_PATH
+        },
+        'tflite': {
+            'path': TFLITE_MODEL_PATH,
+            # Float models expect (pixel - mean) / std, quantized models take raw pixels.
+            'mean': 127.5,
+            'std': 127.5,
+            # The TFLite detection postprocess numbers classes from 0, labelmap ids start at 1.
+            'class_offset': 1
+        },
+        'opencv': {
+            'path': FROZEN_MODEL_PATH,
+            # Text graph generated from the frozen graph by OpenCV's tf_text_graph_ssd.py.
+            'config_path': DNN_CONFIG_PATH,
+            # Frames are resized to the model input size (width, height), scaled then centered.
+            'size': (300, 300),
+            'scale': 1.,
+            'mean': (0, 0, 0),
+            'swap_rb': False
+        },
+        # Thin client of the local inference server, path is the server address.
+        'remote': {
+            'path': INFERENCE_SERVER_ADDRESS,
+            # Frames are sent 'raw' or compressed as 'jpeg' or 'png'.
+            'encoding': 'raw',
+            'quality': 90
+        }
+    },
+    # Post-export graph optimization, see freeze_model.py --optimize.
+    'optimization': {
+        # Graph Transform Tool transforms, strip_unused_nodes is added first with the input type and shape.
+        'transforms': ['remove_nodes(op=CheckNumerics)', 'fold_constants(ignore_errors=true)', 'fold_batch_norms',
+                       'fold_old_batch_norms', 'remove_device', 'sort_by_execution_order'],
+        # Dataset images used to compare the latency of the exported and optimized graphs.
+        'num_samples': 20,
+        'warmup': 3
+    },
+    # Full-integer TFLite export, see freeze_model.py --tflite.
+    'quantization': {
+        # Test split images used to calibrate activation ranges.
+        'num_calibration': 100,
+        # Test split images used to compare the float and quantized models.
+        'num_eval': 50,
+        # Minimum overlap for a quantized detection to match a float detection of the same class.
+        'iou': .5
+    },
+    # Model micro-benchmark, see benchmark_model.py.
+    'benchmark': {
+        'batch_sizes': [1, 4, 8],
+        # Timed batches per case, after the warmup batches.
+        'iterations': 20,
+        'warmup': 3,
+        'output': os.path.join(OUTPUTS_DIR, 'benchmark.json')
+    },
+    # Hot model reload, workers swap their model one at a time when the model file is replaced or on SIGHUP.
+    'reload': {
+        'watch': True,
+        # Model file polling interval (s).
+        'interval': 2
+    },
+    # Hardware autotuning, see load_test.py --autotune.
+    'autotune': {
+        # Machine profile loaded by detect_items.py at startup, {host} is the machine name.
+        'profile_path': os.path.join(OUTPUTS_DIR, 'profiles', '{host}.json'),
+        # Swept settings, numbers of workers default to powers of 2 up to the number of cores.
+        'qualities': ['sd', 'hd', 'full-hd'],
+        'num_workers': None,
+        'queue_sizes': [2, 4, 8, 16],
+        # Measurement of each trial, in seconds.
+        'warmup': 5,
+        'duration': 15
+    },
+    # Local inference server, keeps a model loaded for every client.
+    'server': {
+        # 'unix:path/to/socket' or 'tcp:host:port'.
+        'address': INFERENCE_SERVER_ADDRESS,
+        'backend': 'tensorflow',
+        'num_workers': 1,
+        # Frames of all clients are batched together, up to batch_size frames or batch_timeout (ms).
+        'batch_size': 8,
+        'batch_timeout': 5
+    },
     'default_thresh': 'medium',
     'line_thickness': 3,
     'use_normalize_coordinates': True,
     'max_boxes_to_draw': 8,
     'num_classes': len(ROI_CLASSES),
     'model_dir': os.path.join(OUTPUTS_DIR, 'frozen_inference_graph.pb'),
+    'input_tensor': 'image_tensor:0',
+    'output_tensors': ['detection_boxes:0', 'detection_scores:0', 'detection_classes:0', 'num_detections:0'],
     'labelmap_path': os.path.join(TRAINING_CONFIG_DIR, 'smartbin_labelmap.pbtxt')
 }
 
@@ -7,36 +7,85 @@
     Retrieves videostream and shows detected items.
 
     Usage:
-        detect_items.py [--video-source 0 --quality hd --num-workers 4 --queue-size 8 --min--confidence fair --max-boxes 10]
+        detect_items.py [--video-source 0 [synthetic:1 replay:a.mp4 ...] --quality hd --num-workers 4 --queue-size 8
+                         --min--confidence fair --max-boxes 10
+                         --batch-size 1 --batch-timeout 10 --reorder-deadline 250 --admission-policy block
+                         --headless --sink jsonl:training/outputs/detections.jsonl --metrics-port 0
+                         --metrics-path training/outputs/metrics.json --worker-mode process --pin-cores
+                         --motion-gate --detect-every 1 --inference-size 300x300 --resize-mode stretch
+                         --backend tensorflow --intra-op-threads 2 --no-watch-model]
 
     Options:
-        video-source (int): Capture device ID.
+        video-source (str): Video sources, each one gets its own window or sink: capture device ID, 'replay:path' to
+                            replay a video in real time in a loop, 'file:path' to read it once as fast as the
+                            pipeline goes or 'synthetic:seed' for generated moving boxes, paced sources take an
+                            optional '@FPS' suffix. The program ends once every source ended.
         quality (str): Input quality.
-        num-workers (int): Number of Threads.
-        queue-size (int): Thread queue size.
+        num-workers (int): Number of workers.
+        queue-size (int): Queue size of each source.
         min-confidence (str): Required confidence level to display a box.
         max-boxes (int): Maximum number of boxes to display at a time.
+        batch-size (int): Number of frames processed at once by a worker.
+        batch-timeout (int): Maximum time (ms) a worker waits to fill a batch.
+        reorder-deadline (int): Maximum time (ms) a frame waits for earlier ones before they are dropped.
+        admission-policy (str): What to do with new frames when workers fall behind.
+        headless (bool): Write detections to a sink instead of displaying them.
+        sink (str): Where detections are written in headless mode, 'jsonl:path' or 'unix:path', {source} in the path
+                    gives each source its own sink.
+        metrics-port (int): Local HTTP port serving Prometheus metrics, 0 disables the endpoint.
+        metrics-path (str): File where metrics are dumped on exit, empty to disable.
+        worker-mode (str): One model per worker 'process' or one model shared by worker 'thread's.
+        pin-cores (bool): Pin each worker and the capture thread to disjoint cores.
+        motion-gate (bool): Skip the model on unchanged frames and reuse the last detections.
+        detect-every (int): Run the model on one frame out of detect-every and track boxes in between.
+        inference-size (str): Size WIDTHxHEIGHT frames are resized to in the capture thread before inference.
+        resize-mode (str): Fit frames to the inference size by 'stretch' or 'letterbox'.
+        backend (str): Inference backend, 'tensorflow', 'tflite', 'opencv' or 'remote' to use the inference server.
+        intra-op-threads (int): Threads used by a worker to run a single operation.
+        watch-model (bool): Reload the model when its file is replaced.
+        no-watch-model (bool): Only reload the model on SIGHUP.
+    Workers reload the model one at a time on SIGHUP as well, detections go on with the previous model meanwhile.
+    Defaults come from the machine profile written by load_test.py --autotune when it exists.
 """
 
-import tensorflow as tf
+import time
+import signal
 
 from utils import *
 from config import *
+from queue import Empty
+from queue import Queue as LocalQueue
+from functools import partial
 from argparse import ArgumentParser
-from multiprocessing import Queue, Pool
+from threading import Thread, Event, Semaphore
+from multiprocessing import Lock, Queue, Value
 from object_detection.utils import label_map_util
-from cam_utils import FPS, WebcamVideoStream
+from pipeline_utils import ADMISSION_POLICIES, WORKER_MODES, AdmissionQueue, FrameRing, FrameTask, FrameResult, \
+    BoxTracker, DetectionSchedule, MotionGate, ReorderBuffer, dispatch, plan_cpus, put_latest, request_reload, \
+    start_workers, watch_model
+from model_utils import BACKENDS
+from sink_utils import create_sink
+from profile_utils import get_profile_path, load_profile
+from metrics_utils import PipelineMetrics, MetricsServer, dump_metrics
+from cam_utils import FPS, RESIZE_MODES, letterbox_params, open_stream, parse_size, restore_boxes
 from object_detection.utils import visualization_utils as vis_util
 
 __description__ = "Retrieves videostream and shows detected items."
 
+# Settings tuned for this machine by load_test.py --autotune replace the configured defaults.
+profile = load_profile()
+if profile is not None:
+    print("Machine profile {path} loaded: {settings}.".format(path=get_profile_path(), settings=profile))
+
 # Parse args.
 parser = ArgumentParser(description=__description__)
 
 parser.add_argument("-v-source", "--video-source", dest="video_source",
-                    type=int,
-                    default=DEVICE_CONFIG["id"],
-                    help="Capture device identifier, default is {default}.".format(default=DEVICE_CONFIG["id"]))
+                    type=str,
+                    nargs="+",
+                    default=[str(DEVICE_CONFIG["id"])],
+                    help="Video sources, device ID, 'replay:path', 'file:path' or 'synthetic:seed', all served by the "
+                         "same workers, default is {default}.".format(default=DEVICE_CONFIG["id"]))
 
 parser.add_argument("-q", "--quality", dest="quality",
                     type=str,
@@ -66,6 +115,116 @@ parser.add_argument("-max-b", "--max-boxes", dest='max_boxes',
                     help="Max number of boxes to draw at a time, default is {default}.".format(
                         default=DETECTION_CONFIG["max_boxes_to_draw"]))
 
+parser.add_argument("-b-size", "--batch-size", dest="batch_size",
+                    type=int,
+                    default=DETECTION_CONFIG["batch_size"],
+                    help="Number of frames processed at once by a worker, default is {default}.".format(
+                        default=DETECTION_CONFIG["batch_size"]))
+
+parser.add_argument("-b-timeout", "--batch-timeout", dest="batch_timeout",
+                    type=int,
+                    default=DETECTION_CONFIG["batch_timeout"],
+                    help="Maximum time (ms) a worker waits to fill a batch, default is {default}.".format(
+                        default=DETECTION_CONFIG["batch_timeout"]))
+
+parser.add_argument("-r-deadline", "--reorder-deadline", dest="reorder_deadline",
+                    type=int,
+                    default=DETECTION_CONFIG["reorder_deadline"],
+                    help="Maximum time (ms) a frame waits for earlier ones, default is {default}.".format(
+                        default=DETECTION_CONFIG["reorder_deadline"]))
+
+parser.add_argument("-a-policy", "--admission-policy", dest="admission_policy",
+                    type=str,
+                    choices=ADMISSION_POLICIES,
+                    default=DETECTION_CONFIG["admission_policy"],
+                    help="What to do with new frames when workers fall behind, default is {default}.".format(
+                        default=DETECTION_CONFIG["admission_policy"]))
+
+parser.add_argument("--headless", dest="headless",
+                    action="store_true",
+                    help="Write detections to a sink instead of displaying them, default is {default}.".format(
+                        default=False))
+
+parser.add_argument("--sink", dest="sink",
+                    type=str,
+                    default=DETECTION_CONFIG["sink"],
+                    help="Where detections are written in headless mode, {{source}} in the path gives each source "
+                         "its own sink, default is {default}.".format(default=DETECTION_CONFIG["sink"]))
+
+parser.add_argument("--metrics-port", dest="metrics_port",
+                    type=int,
+                    default=DETECTION_CONFIG["metrics_port"],
+                    help="Local HTTP port serving Prometheus metrics, 0 disables it, default is {default}.".format(
+                        default=DETECTION_CONFIG["metrics_port"]))
+
+parser.add_argument("--metrics-path", dest="metrics_path",
+                    type=str,
+                    default=DETECTION_CONFIG["metrics_path"],
+                    help="File where metrics are dumped on exit, default is {default}.".format(
+                        default=DETECTION_CONFIG["metrics_path"]))
+
+parser.add_argument("--worker-mode", dest="worker_mode",
+                    type=str,
+                    choices=WORKER_MODES,
+                    default=DETECTION_CONFIG["worker_mode"],
+                    help="One model per worker process or one model shared by worker threads, default is {default}."
+                    .format(default=DETECTION_CONFIG["worker_mode"]))
+
+parser.add_argument("--pin-cores", dest="pin_cores",
+                    action="store_true",
+                    help="Pin each worker and the capture thread to disjoint cores, default is {default}.".format(
+                        default=DETECTION_CONFIG["cpu"]["pin"]))
+
+parser.add_argument("--motion-gate", dest="motion_gate",
+                    action="store_true",
+                    default=DETECTION_CONFIG["motion"]["enabled"],
+                    help="Skip the model on unchanged frames, default is {default}.".format(
+                        default=DETECTION_CONFIG["motion"]["enabled"]))
+
+parser.add_argument("--detect-every", dest="detect_every",
+                    type=int,
+                    default=DETECTION_CONFIG["tracking"]["detect_every"] if DETECTION_CONFIG["tracking"]["enabled"]
+                    else 1,
+                    help="Run the model on one frame out of detect-every and track boxes in between, default is "
+                         "{default}.".format(default=DETECTION_CONFIG["tracking"]["detect_every"]
+                                             if DETECTION_CONFIG["tracking"]["enabled"] else 1))
+
+parser.add_argument("--inference-size", dest="inference_size",
+                    type=parse_size,
+                    default=DETECTION_CONFIG["inference_size"],
+                    help="Size WIDTHxHEIGHT frames are resized to before inference, default is {default}.".format(
+                        default=DETECTION_CONFIG["inference_size"]))
+
+parser.add_argument("--resize-mode", dest="resize_mode",
+                    type=str,
+                    choices=RESIZE_MODES,
+                    default=DETECTION_CONFIG["resize_mode"],
+                    help="Fit frames to the inference size by stretching or letterboxing, default is {default}."
+                    .format(default=DETECTION_CONFIG["resize_mode"]))
+
+parser.add_argument("--backend", dest="backend",
+                    type=str,
+                    choices=list(BACKENDS.keys()),
+                    default=DETECTION_CONFIG["backend"],
+                    help="Inference backend, default is {default}.".format(default=DETECTION_CONFIG["backend"]))
+
+parser.add_argument("--intra-op-threads", dest="intra_op_threads",
+                    type=int,
+                    default=DETECTION_CONFIG["cpu"]["intra_op_threads"],
+                    help="Threads used by a worker to run a single operation, derived from the cores if not set, "
+                         "default is {default}.".format(default=DETECTION_CONFIG["cpu"]["intra_op_threads"]))
+
+parser.add_argument("--watch-model", dest="watch_model",
+                    action="store_true",
+                    default=DETECTION_CONFIG["reload"]["watch"],
+                    help="Reload the model when its file is replaced, default is {default}.".format(
+                        default=DETECTION_CONFIG["reload"]["watch"]))
+
+parser.add_argument("--no-watch-model", dest="watch_model",
+                    action="store_false",
+                    default=DETECTION_CONFIG["reload"]["watch"],
+                    help="Only reload the model on SIGHUP.")
+
 args = parser.parse_args()
 
 # Load labelmap file.
@@ -75,71 +234,318 @@ categories = label_map_util.convert_label_map_to_categories(label_map, max_num_c
 category_index = label_map_util.create_category_index(categories)
 
 
-def detect_objects(image_np, sess, detection_graph):
+def draw_detections(image_np, boxes, scores, classes):
     """
-    Detects objects on a frame.
+    Draws the detections of a single frame.
     :param image_np: input frame.
-    :param sess: Tensorflow session.
-    :param detection_graph: Tensorflow model.
-    :return: detected items.
+    :param boxes: detected boxes.
+    :param scores: detection scores.
+    :param classes: detected classes.
+    :return: annotated frame.
     """
-    # Expand dimensions of the model.
-    image_np_expanded = np.expand_dims(image_np, axis=0)
-    image_tensor = detection_graph.get_tensor_by_name('image_tensor:0')
-
-    # Each box represents a part of the image where a particular object was detected.
-    boxes = detection_graph.get_tensor_by_name('detection_boxes:0')
-
-    # Each score represents the level of confidence for each object.
-    # Score is shown on the result image, together with the class label.
-    scores = detection_graph.get_tensor_by_name('detection_scores:0')
-    classes = detection_graph.get_tensor_by_name('detection_classes:0')
-    num_detections = detection_graph.get_tensor_by_name('num_detections:0')
-
-    # Actual detection.
-    (boxes, scores, classes, num_detections) = sess.run(
-        [boxes, scores, classes, num_detections],
-        feed_dict={image_tensor: image_np_expanded})
-
-    # Visualization of the results of a detection.
     vis_util.visualize_boxes_and_labels_on_image_array(
         image_np,
-        np.squeeze(boxes),
-        np.squeeze(classes).astype(np.int32),
-        np.squeeze(scores),
+        boxes,
+        classes.astype(np.int32),
+        scores,
         category_index,
-        use_normalized_coordinates=["use_normalized_coordinates"],
+        use_normalized_coordinates=DETECTION_CONFIG["use_normalize_coordinates"],
         line_thickness=DETECTION_CONFIG["line_thickness"],
         max_boxes_to_draw=args.max_boxes,
         min_score_thresh=SCORE_TRESH[args.min_confidence])
     return image_np
 
 
-def worker(input_q, output_q):
+class CaptureSource(object):
+    """
+    Class holding the videostream of a capture source and its own share of the pipeline: frames buffer, admission
+    queue, reorder buffer, tracking state and metrics. Every source feeds the same detection workers.
+    """
+
+    def __init__(self, index, src, width, height, num_slots, cores=None):
+        """
+        Starts the videostream and allocates the source resources.
+        :param index: source index, carried along with each frame.
+        :param src: video source, see cam_utils.parse_source.
+        :param width: capture width.
+        :param height: capture height.
+        :param num_slots: number of frames the source can have in flight.
+        :param cores: cores the capture Thread is pinned to.
+        """
+        self.index = index
+        self.src = src
+
+        # Grab video input, frames are also resized in the capture Thread if an inference size is set.
+        self.stream = open_stream(src, width, height, cores=cores, inference_size=args.inference_size,
+                                  resize_mode=args.resize_mode).start()
+        captured, resized = self.stream.read_resized()
+        self.title = "Webcam videostream ({width} x {height})".format(width=captured.shape[1],
+                                                                      height=captured.shape[0])
+
+        # Share one slot per frame in flight, sized after the frames the device actually delivers.
+        self.frame_ring = FrameRing(num_slots, resized.shape)
+
+        # Display draws on copies of the captured frames, kept by reference since the capture Thread allocates a new
+        # frame each time.
+        self.captured_frames = [None] * num_slots if args.inference_size and not args.headless else None
+
+        # Boxes of letterboxed frames must be mapped back to the captured frames.
+        self.restore = None
+        if args.inference_size and args.resize_mode == "letterbox":
+            self.restore = partial(restore_boxes, params=letterbox_params(captured.shape, args.inference_size))
+
+        # Admit frames according to the selected policy, admitted frames wait for their turn to reach the workers.
+        self.queue = LocalQueue(maxsize=args.queue_size)
+        self.admission = AdmissionQueue(self.queue, policy=args.admission_policy, on_drop=self.drop)
+        self.reorder = ReorderBuffer(deadline=args.reorder_deadline / 1000)
+
+        # Only run the model on frames which changed.
+        self.motion_gate = MotionGate() if args.motion_gate else None
+
+        # Only run the model on some frames and track boxes in between.
+        if args.detect_every > 1:
+            self.schedule = DetectionSchedule(dict(DETECTION_CONFIG["tracking"], detect_every=args.detect_every))
+            self.tracker = BoxTracker(min_score=SCORE_TRESH[args.min_confidence])
+        else:
+            self.schedule = self.tracker = None
+
+        # Detections reused by frames which skipped the model.
+        self.last = (np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32),
+                     np.zeros(0, dtype=np.float32))
+
+        # Expose pipeline counters along with latencies.
+        self.metrics = PipelineMetrics(window=DETECTION_CONFIG["metrics_window"], labels={"source": index})
+        self.metrics.gauge("admitted_frames", "Frames admitted into the workers queue.",
+                           lambda: self.admission.admitted)
+        self.metrics.gauge("dropped_frames", "Frames dropped by the admission policy.",
+                           lambda: self.admission.dropped)
+        self.metrics.gauge("late_frames", "Frames dropped by the reorder buffer.", lambda: self.reorder.dropped)
+        self.metrics.gauge("missed_frames", "Frames the device delivered while the pipeline was full.",
+                           lambda: self.missed)
+        if self.motion_gate is not None:
+            self.metrics.gauge("skipped_frames", "Frames skipped by the motion gate.",
+                               lambda: self.motion_gate.skipped)
+            self.metrics.gauge("inferred_frames", "Frames sent to the model by the motion gate.",
+                               lambda: self.motion_gate.inferred)
+
+        self.display_q = LocalQueue(maxsize=DETECTION_CONFIG["display_queue_size"])
+        self.sink = None
+        self.missed = 0
+        self.captured = 0
+        self.fps = FPS()
+
+    def drop(self, task):
+        """
+        Frees the slot of a frame which won't be processed.
+        :param task: dropped frame.
+        :return: void.
+        """
+        self.reorder.skip(task.seq)
+        self.frame_ring.release(task.slot)
+        self.forget()
+
+    def forget(self):
+        """
+        Makes the motion gate send the next frame to the model, the detections of its reference frame are lost and
+        unchanged frames would otherwise reuse older ones.
+        :return: void.
+        """
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+
+    def capture(self, stop_event, ready):
+        """
+        Reads the videostream and admits frames until the program exits.
+        :param stop_event: event set when the program exits.
+        :param ready: semaphore released each time a frame is admitted.
+        :return: void.
+        """
+        self.fps.start()
+        seq, last_seq = 0, None
+
+        while not stop_event.is_set():
+            # Wait for a free slot, the pipeline is full otherwise.
+            try:
+                slot = self.frame_ring.acquire(timeout=.1)
+            except Empty:
+                continue
+
+            # Wait for a frame which wasn't read yet and send its slot to AI, latencies start at the capture time.
+            frame = self.stream.read_new(timeout=.1)
+            if frame is None:
+                self.frame_ring.release(slot)
+                if self.stream.stopped:
+                    print("Source {index}: videostream stopped.".format(index=self.index))
+                    return
+                continue
+            if last_seq is not None:
+                self.missed += frame.seq - last_seq - 1
+            last_seq, timestamp = frame.seq, frame.timestamp
+
+            self.frame_ring.write(slot, frame.resized)
+            if self.captured_frames is not None:
+                self.captured_frames[slot] = frame.frame
+            queued = time.time()
+            self.metrics.observe('capture', queued - timestamp, now=queued)
+
+            # Unscheduled or unchanged frames skip the workers and get the detections of the previous frame.
+            if (self.schedule is not None and not self.schedule.due(timestamp)) or (
+                    self.motion_gate is not None and not self.motion_gate.changed(self.frame_ring.slot(slot))):
+                if not self.reorder.push(FrameResult(self.index, seq, timestamp, slot, None, None, None, {}),
+                                         wait=False):
+                    self.frame_ring.release(slot)
+            else:
+                self.admission.put(FrameTask(self.index, seq, timestamp, queued, slot))
+                ready.release()
+            seq += 1
+            self.captured = seq
+
+    def complete(self, result):
+        """
+        Fills the detections of a frame which skipped the model and maps boxes back to the captured frame.
+        :param result: frame detections, in capture order.
+        :return: completed frame detections.
+        """
+        if self.tracker is not None:
+            start = time.time()
+            if result.boxes is None:
+                boxes, scores, classes = self.tracker.update(self.frame_ring.slot(result.slot))
+                result = result._replace(boxes=boxes, scores=scores, classes=classes)
+            else:
+                self.tracker.reset(self.frame_ring.slot(result.slot), result.boxes, result.scores, result.classes)
+            self.metrics.observe('tracking', time.time() - start)
+        elif result.boxes is None:
+            result = result._replace(boxes=self.last[0], scores=self.last[1], classes=self.last[2])
+
+        self.last = (result.boxes, result.scores, result.classes)
+        if self.restore is not None:
+            result = result._replace(boxes=self.restore(result.boxes))
+        return result
+
+
+def collect(output_q, sources, stop_event, handle):
+    """
+    Routes processed frames to their source and puts them back in capture order.
+    :param output_q: detections of the processed frames.
+    :param sources: capture sources, by index.
+    :param stop_event: event set when the program exits.
+    :param handle: function called with the source and each of its frames in order, in charge of releasing its slot.
+    :return: void.
+    """
+    while not stop_event.is_set():
+        try:
+            result = output_q.get(timeout=.02)
+            source = sources[result.source]
+            for stage, seconds in result.timings.items():
+                source.metrics.observe(stage, seconds)
+
+            # Frames given up on while they were processed are dropped.
+            if not source.reorder.push(result):
+                source.frame_ring.release(result.slot)
+                source.forget()
+        except Empty:
+            pass
+
+        for source in sources:
+            for result in source.reorder.pop():
+                source.fps.update()
+                handle(source, source.complete(result))
+
+
+def publish(source, result):
+    """
+    Writes the detections of a frame to the sink of its source.
+    :param source: capture source.
+    :param result: frame detections.
+    :return: void.
+    """
+    # Pixels are not needed anymore.
+    source.frame_ring.release(result.slot)
+
+    start = time.time()
+    source.sink.write({
+        'source': source.index,
+        'seq': result.seq,
+        'timestamp': result.timestamp,
+        'detections': get_detection_boxes(boxes=result.boxes, classes=result.classes.astype(np.int32),
+                                          scores=result.scores, category_index=category_index,
+                                          tresh_level=args.min_confidence, max_boxes_to_draw=args.max_boxes)
+    })
+    end = time.time()
+
+    source.metrics.observe('postprocess', end - start, now=end)
+    source.metrics.observe('total', end - result.timestamp, now=end)
+    source.metrics.tick(now=end)
+
+
+def enqueue_display(source, result):
+    """
+    Hands a frame over to the display loop, the oldest waiting frame is dropped if the display falls behind.
+    :param source: capture source.
+    :param result: frame detections.
+    :return: void.
+    """
+    put_latest(source.display_q, result, on_drop=lambda dropped: source.frame_ring.release(dropped.slot))
+
+
+def watch_sources(sources, capture_threads, stop_event, timeout=DETECTION_CONFIG["drain_timeout"]):
     """
-    Loads a frozen Tensorflow model in memory.
-    :param input_q:
-    :param output_q:
-    :return:
+    Stops the program once every videostream ended and its last frames came out of the pipeline.
+    :param sources: capture sources.
+    :param capture_threads: capture Thread of each source.
+    :param stop_event: event set when the program exits.
+    :param timeout: maximum time (s) to wait for the last frames once every videostream ended.
+    :return: void.
     """
-    detection_graph = tf.Graph()
-    with detection_graph.as_default():
-        od_graph_def = tf.GraphDef()
-        with tf.gfile.GFile(FROZEN_MODEL_PATH, 'rb') as fid:
-            serialized_graph = fid.read()
-            od_graph_def.ParseFromString(serialized_graph)
-            tf.import_graph_def(od_graph_def, name='')
+    ended = None
+    while not stop_event.wait(.1):
+        if any(thread.is_alive() for thread in capture_threads):
+            continue
 
-        sess = tf.Session(graph=detection_graph)
+        # Frames are emitted or given up in order, the pipeline is drained once every captured frame went through.
+        ended = ended or time.time()
+        if all(source.reorder.next_seq >= source.captured for source in sources) or time.time() - ended > timeout:
+            stop_event.set()
 
-        fps = FPS().start()
-        while True:
-            fps.update()
-            frame = input_q.get()
-            output_q.put(detect_objects(frame, sess, detection_graph))
 
-        fps.stop()
-        sess.close()
+def display(sources, stop_event):
+    """
+    Draws and shows processed frames, one window per source, runs on the main Thread.
+    :param sources: capture sources.
+    :param stop_event: event set when the program exits.
+    :return: void.
+    """
+    try:
+        while not stop_event.is_set():
+            shown = False
+            for source in sources:
+                try:
+                    result = source.display_q.get_nowait()
+                except Empty:
+                    continue
+
+                shown = True
+                start = time.time()
+                frame_ring, metrics = source.frame_ring, source.metrics
+                # Captured frames are still referenced by the stream history, boxes are drawn on a copy.
+                frame = frame_ring.slot(result.slot) if source.captured_frames is None else \
+                    source.captured_frames[result.slot].copy()
+                frame = draw_detections(frame, result.boxes, result.scores, result.classes)
+                drawn = time.time()
+                cv.imshow(source.title, frame)
+                frame_ring.release(result.slot)
+
+                end = time.time()
+                metrics.observe('postprocess', drawn - start, now=drawn)
+                metrics.observe('display', end - drawn, now=end)
+                metrics.observe('total', end - result.timestamp, now=end)
+                metrics.tick(now=end)
+
+            # Exit program on the Q click, wait a little longer when no frame was ready.
+            if cv.waitKey(1 if shown else 10) & 0xFF == ord('q'):
+                stop_event.set()
+    finally:
+        cv.destroyAllWindows()
 
 
 def main():
@@ -147,42 +553,122 @@ def main():
     Main program.
     :return: void.
     """
-    # Create a Thread pool.
-    input_q = Queue(maxsize=args.queue_size)
-    output_q = Queue(maxsize=args.queue_size)
-    pool = Pool(args.num_workers, worker, (input_q, output_q))
-
     # Load camera configuration.
     width, height = INPUT_RESOLUTION[args.quality]["width"], INPUT_RESOLUTION[args.quality]["height"]
 
-    # Grab video input.
-    video_capture = WebcamVideoStream(src=args.video_source, width=width, height=height).start()
-    fps = FPS().start()
-
-    # Read video input.
-    while True:
-        # Update framerate.
-        fps.update()
-
-        # Grab frame.
-        frame = video_capture.read()
-
-        # Send frame to AI.
-        input_q.put(frame)
-
-        # Show processed frame.
-        cv.imshow("Webcam videostream ({width} x {height})".format(width=width, height=height), output_q.get())
-
-        # Exit program on the Q click.
-        if cv.waitKey(1) & 0xFF == ord('q'):
-            break
-
-    fps.stop()
+    # Split cores between capture and workers.
+    cpu_plan = plan_cpus(args.num_workers, args.worker_mode, dict(DETECTION_CONFIG["cpu"],
+                                                                  pin=args.pin_cores or DETECTION_CONFIG["cpu"]["pin"],
+                                                                  intra_op_threads=args.intra_op_threads))
+    print("CPU plan: capture on {capture}, workers on {workers}, {intra} intra-op and {inter} inter-op threads.".format(
+        capture=cpu_plan["capture"] or "any core", workers=cpu_plan["workers"], intra=cpu_plan["intra_op_threads"],
+        inter=cpu_plan["inter_op_threads"]))
+
+    # Each source may have frames waiting in its own queue, the workers queue, the workers, the output queue and the
+    # display queue.
+    num_slots = args.queue_size * 2 + args.num_workers * args.batch_size * 2 + \
+        DETECTION_CONFIG["display_queue_size"] + 1
+    sources = [CaptureSource(index, src, width, height, num_slots, cores=cpu_plan["capture"])
+               for index, src in enumerate(args.video_source)]
+    for source in sources:
+        if len(sources) > 1:
+            source.title = "{title} - source {index}".format(title=source.title, index=source.index)
+        print("Source {index}: {src}, {shape} frames.".format(
+            index=source.index, src=source.src, shape=source.frame_ring.shape))
+
+    # Create the workers, shared by every source, threads share the queues of the current process.
+    # The workers queue is kept short so that frames are picked fairly from the sources queues.
+    queue_type = Queue if args.worker_mode == "process" else LocalQueue
+    input_q = queue_type(maxsize=args.num_workers * args.batch_size)
+    output_q = queue_type(maxsize=args.queue_size * len(sources))
+    # Workers reload their model when the version changes, the inference server owns the model of the remote backend.
+    model_version = Value("i", 0) if args.backend != "remote" else None
+    pool = start_workers(args.worker_mode, args.num_workers, input_q, output_q,
+                         [source.frame_ring for source in sources], cpu_plan=cpu_plan, backend=args.backend,
+                         version=model_version, reload_lock=Lock(), batch_size=args.batch_size,
+                         batch_timeout=args.batch_timeout, max_boxes=args.max_boxes)
+
+    stop_event = Event()
+    if model_version is not None:
+        signal.signal(signal.SIGHUP, lambda signum, frame: request_reload(model_version))
+        if args.watch_model:
+            Thread(target=watch_model, args=(DETECTION_CONFIG["backends"][args.backend]["path"], model_version,
+                                             stop_event), daemon=True).start()
+    ready = Semaphore(0)
+
+    sinks = []
+    if args.headless:
+        # Write detections without any visualization, sources share the sink unless its path depends on the source.
+        for source in sources:
+            if "{source}" in args.sink or not sinks:
+                sinks.append(create_sink(args.sink.format(source=source.index)))
+            source.sink = sinks[-1]
+        threads = [Thread(target=collect, args=(output_q, sources, stop_event, publish))]
+    else:
+        # Reorder frames on their own Thread and display them on the main one, as GUI backends require. A slow
+        # display drops frames instead of stalling the pipeline.
+        threads = [Thread(target=collect, args=(output_q, sources, stop_event, enqueue_display))]
+    threads.append(Thread(target=dispatch, args=([source.queue for source in sources], input_q, stop_event, ready)))
+
+    # Each source is read by its own Thread.
+    capture_threads = [Thread(target=source.capture, args=(stop_event, ready)) for source in sources]
+    for thread in threads + capture_threads:
+        thread.start()
+    Thread(target=watch_sources, args=(sources, capture_threads, stop_event), daemon=True).start()
+
+    metrics = [source.metrics for source in sources]
+    server = MetricsServer(metrics, args.metrics_port).start() if args.metrics_port else None
+
+    # Display until the Q click, headless mode exits on Ctrl+C. Both stop once every source ended.
+    try:
+        if args.headless:
+            while not stop_event.wait(.1):
+                pass
+        else:
+            display(sources, stop_event)
+    except KeyboardInterrupt:
+        stop_event.set()
+
+    # Sources blocked on a full queue are released once their frames are dropped.
+    for thread in threads:
+        thread.join()
+    for source, thread in zip(sources, capture_threads):
+        while thread.is_alive():
+            while True:
+                try:
+                    source.drop(source.queue.get_nowait())
+                except Empty:
+                    break
+            thread.join(.1)
+        source.fps.stop()
+
+    for source in sources:
+        print("Source {index}: {frames} frames at {fps:.1f} FPS.".format(index=source.index,
+                                                                         frames=source.fps._numFrames,
+                                                                         fps=source.fps.fps()))
+        if source.motion_gate is not None:
+            print("{inferred} frames inferred, {skipped} skipped by the motion gate.".format(
+                inferred=source.motion_gate.inferred, skipped=source.motion_gate.skipped))
+        print("{admitted} frames admitted, {dropped} dropped by the {policy} policy, {late} dropped as late, {missed} "
+              "missed while the pipeline was full.".format(admitted=source.admission.admitted,
+                                                           dropped=source.admission.dropped,
+                                                           policy=source.admission.policy, late=source.reorder.dropped,
+                                                           missed=source.missed))
 
     # End program properly.
-    pool.terminate()
-    video_capture.stop()
-    cv.destroyAllWindows()
+    if pool is not None:
+        pool.terminate()
+    for source in sources:
+        source.stream.stop()
+
+    for sink in sinks:
+        sink.close()
+
+    if server is not None:
+        server.stop()
+    if args.metrics_path:
+        dump_metrics(metrics, args.metrics_path)
+        print("Metrics saved in {path}.".format(path=args.metrics_path))
 
 
 if __name__ == "__main__":
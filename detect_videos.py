@@ -0,0 +1,316 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Videos detection.
+    ======================
+    Runs the frozen model over recorded videos as fast as possible and saves detections as columns.
+
+    Usage:
+        detect_videos.py [--input-dir pretraining/raw_videos --output training/outputs/video_detections.npz
+                          --num-workers 4 --batch-size 8 --stride 1 --min-confidence medium --max-boxes 8
+                          --backend tensorflow]
+
+    Options:
+        input-dir (str): Directory of the video files.
+        output (str): Output detections file.
+        num-workers (int): Number of workers, each one gets its share of cores, long videos are split between them.
+        batch-size (int): Number of frames processed at once by a worker.
+        stride (int): Only process one frame out of stride.
+        min-confidence (str): Required confidence level to keep a box.
+        max-boxes (int): Maximum number of boxes kept per frame.
+        backend (str): Inference backend, 'tensorflow', 'tflite', 'opencv' or 'remote' to use the inference server.
+"""
+
+from utils import *
+from config import *
+from queue import Full
+from threading import Event, Thread
+from queue import Queue as LocalQueue
+from argparse import ArgumentParser
+from multiprocessing import Pool, Value
+from model_utils import BACKENDS, create_model
+from pipeline_utils import plan_cpus
+
+__description__ = "Runs the frozen model over recorded videos and saves detections as columns."
+
+# Parse args.
+parser = ArgumentParser(description=__description__)
+
+parser.add_argument("-i", "--input-dir", dest="input_dir",
+                    type=str,
+                    default=RAW_VIDEOS_DIR,
+                    help="Directory of the video files, default is {default}.".format(default=RAW_VIDEOS_DIR))
+
+parser.add_argument("-o", "--output", dest="output",
+                    type=str,
+                    default=DETECTION_CONFIG["video_output"],
+                    help="Output detections file, default is {default}.".format(
+                        default=DETECTION_CONFIG["video_output"]))
+
+parser.add_argument('-num-w', '--num-workers', dest='num_workers',
+                    type=int,
+                    default=DETECTION_CONFIG["num_workers"],
+                    help='Number of workers sharing the frames of the videos, default is {default}.'.format(
+                        default=DETECTION_CONFIG["num_workers"]))
+
+parser.add_argument("-b-size", "--batch-size", dest="batch_size",
+                    type=int,
+                    default=8,
+                    help="Number of frames processed at once by a worker, default is {default}.".format(default=8))
+
+parser.add_argument("--stride", dest="stride",
+                    type=int,
+                    default=1,
+                    help="Only process one frame out of stride, default is {default}.".format(default=1))
+
+parser.add_argument('-min-c', "--min-confidence", dest="min_confidence",
+                    type=str,
+                    choices=list(SCORE_TRESH.keys()),
+                    default=DETECTION_CONFIG["default_thresh"],
+                    help="Required confidence to keep a box, default is {default}.".format(
+                        default=DETECTION_CONFIG["default_thresh"]))
+
+parser.add_argument("-max-b", "--max-boxes", dest='max_boxes',
+                    type=int,
+                    default=DETECTION_CONFIG["max_boxes_to_draw"],
+                    help="Max number of boxes kept per frame, default is {default}.".format(
+                        default=DETECTION_CONFIG["max_boxes_to_draw"]))
+
+parser.add_argument("--backend", dest="backend",
+                    type=str,
+                    choices=list(BACKENDS.keys()),
+                    default=DETECTION_CONFIG["backend"],
+                    help="Inference backend, default is {default}.".format(default=DETECTION_CONFIG["backend"]))
+
+args = parser.parse_args()
+
+# Detection columns and their types.
+COLUMNS = [('frame', np.int32), ('class', np.int16), ('score', np.float32), ('ymin', np.float32),
+           ('xmin', np.float32), ('ymax', np.float32), ('xmax', np.float32)]
+
+# Model of the current worker.
+model = None
+
+
+def init_worker(backend, cpu_plan, counter):
+    """
+    Loads the detection model in memory once per worker, on the cores of the worker.
+    :param backend: inference backend.
+    :param cpu_plan: CPU allocation, see pipeline_utils.plan_cpus.
+    :param counter: shared counter giving each worker its index.
+    :return: void.
+    """
+    global model
+
+    with counter.get_lock():
+        index = counter.value % len(cpu_plan['workers'])
+        counter.value += 1
+
+    # Pin before loading the model so that runtime threads inherit the affinity.
+    set_cpu_affinity(cpu_plan['workers'][index])
+    model = create_model(backend, intra_op_threads=cpu_plan['worker_intra_op_threads'][index],
+                         inter_op_threads=cpu_plan['inter_op_threads'])
+
+
+def count_frames(video_path):
+    """
+    Reads the number of frames of a video from its container.
+    :param video_path: video file path.
+    :return: number of frames, 0 if unknown.
+    """
+    cap = cv.VideoCapture(video_path)
+    count = max(0, int(cap.get(cv.CAP_PROP_FRAME_COUNT)))
+    cap.release()
+    return count
+
+
+def split_videos(videos, num_workers):
+    """
+    Splits videos into frame ranges so that long recordings are shared by several workers.
+    Frame counts come from the containers, seeking relies on OpenCV frame accurate seeking.
+    :param videos: video file paths.
+    :param num_workers: number of workers.
+    :return: list of (video path, first frame, end frame) segments, the last segment of a video ends with the video.
+    """
+    counts = [count_frames(video_path) for video_path in videos]
+
+    # Several segments per worker balance the load, segments hold whole batches.
+    length = max(args.batch_size * args.stride,
+                 -(-sum(counts) // (num_workers * DETECTION_CONFIG["video_segments_per_worker"])))
+    segments = []
+    for video_path, count in zip(videos, counts):
+        bounds = list(range(0, count, length)) or [0]
+        segments += [(video_path, first, end) for first, end in zip(bounds, bounds[1:] + [None])]
+    return segments
+
+
+def decode_video(video_path, frames_q, stride, first, end, stop_event):
+    """
+    Decodes a range of frames of a video file and queues them, None marks the end of the range.
+    :param video_path: video file path.
+    :param frames_q: decoded frames queue.
+    :param stride: only queue one frame out of stride, counted from the start of the video.
+    :param first: index of the first frame.
+    :param end: index of the frame after the range, the range ends with the video if not set.
+    :param stop_event: event set when the frames are not needed anymore.
+    :return: void.
+    """
+    def put(item):
+        """
+        Queues an item unless decoding is stopped.
+        :param item: queued item.
+        :return: False if decoding is stopped.
+        """
+        while not stop_event.is_set():
+            try:
+                frames_q.put(item, timeout=.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    cap = cv.VideoCapture(video_path)
+    if first:
+        cap.set(cv.CAP_PROP_POS_FRAMES, first)
+    index = first
+
+    while cap.isOpened() and (end is None or index < end):
+        # Skipped frames are grabbed but never decoded.
+        if index % stride:
+            if not cap.grab():
+                break
+        else:
+            ret, frame = cap.read()
+            if not ret or not put((index, frame)):
+                break
+        index += 1
+
+    cap.release()
+    put(None)
+
+
+def extract_columns(indexes, boxes, scores, classes):
+    """
+    Keeps the boxes above the confidence level of a batch of frames as columns.
+    :param indexes: frame indexes.
+    :param boxes: detected boxes, one row per frame.
+    :param scores: detection scores, one row per frame.
+    :param classes: detected classes, one row per frame.
+    :return: dictionary of columns.
+    """
+    max_boxes = args.max_boxes or scores.shape[1]
+    boxes, scores, classes = boxes[:, :max_boxes], scores[:, :max_boxes], classes[:, :max_boxes]
+
+    mask = scores > SCORE_TRESH[args.min_confidence]
+    frames = np.repeat(np.asarray(indexes)[:, np.newaxis], scores.shape[1], axis=1)
+
+    return {
+        'frame': frames[mask],
+        'class': classes[mask],
+        'score': scores[mask],
+        'ymin': boxes[..., 0][mask],
+        'xmin': boxes[..., 1][mask],
+        'ymax': boxes[..., 2][mask],
+        'xmax': boxes[..., 3][mask]
+    }
+
+
+def detect_video(segment):
+    """
+    Detects items on every frame of a video segment, decoding runs on its own thread to overlap with inference.
+    :param segment: video path, first frame and end frame, see split_videos.
+    :return: video path, first frame, number of processed frames and dictionary of detection columns.
+    """
+    video_path, first, end = segment
+    frames_q = LocalQueue(maxsize=DETECTION_CONFIG["decode_queue_size"])
+    stop_event = Event()
+    decoder = Thread(target=decode_video, args=(video_path, frames_q, args.stride, first, end, stop_event),
+                     daemon=True)
+    decoder.start()
+
+    chunks = []
+    num_frames = 0
+    done = False
+    try:
+        while not done:
+            # Gather a batch of frames.
+            batch = []
+            while len(batch) < args.batch_size:
+                item = frames_q.get()
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+
+            if not batch:
+                break
+
+            indexes, frames = zip(*batch)
+            (boxes, scores, classes, _) = model.detect(np.stack(frames))
+            chunks.append(extract_columns(indexes, boxes, scores, classes))
+            num_frames += len(indexes)
+    finally:
+        # The decoder may be blocked on a full queue if detection failed.
+        stop_event.set()
+        decoder.join()
+
+    columns = {name: np.concatenate([chunk[name] for chunk in chunks]).astype(dtype) if chunks else
+               np.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+    return video_path, first, num_frames, columns
+
+
+def main():
+    """
+    Main program.
+    :return: void.
+    """
+    videos = sorted(list_files(args.input_dir, VIDEO_EXT))
+
+    if not videos:
+        print("No video found in {dir}.".format(dir=args.input_dir))
+        return
+
+    start = datetime.now()
+
+    # Each worker loads the model once on its own cores, videos are split into frame ranges shared by the workers.
+    segments = split_videos(videos, args.num_workers)
+    num_workers = min(args.num_workers, len(segments))
+    cpu_plan = plan_cpus(num_workers, "process")
+    pool = Pool(num_workers, init_worker, (args.backend, cpu_plan, Value("i", 0)))
+
+    pending = {video_path: [] for video_path in videos}
+    remaining = {video_path: sum(segment[0] == video_path for segment in segments) for video_path in videos}
+    for (video_path, first, num_frames, columns) in pool.imap_unordered(detect_video, segments):
+        pending[video_path].append((first, num_frames, columns))
+        remaining[video_path] -= 1
+        if not remaining[video_path]:
+            print("{video}: {frames} frames, {boxes} boxes.".format(
+                video=os.path.basename(video_path), frames=sum(chunk[1] for chunk in pending[video_path]),
+                boxes=sum(len(chunk[2]['frame']) for chunk in pending[video_path])))
+    pool.close()
+    pool.join()
+
+    # Segments are put back in frame order.
+    names, frame_counts, results = [], [], []
+    for video_id, video_path in enumerate(videos):
+        chunks = sorted(pending[video_path], key=lambda chunk: chunk[0])
+        names.append(os.path.basename(video_path))
+        frame_counts.append(sum(num_frames for _, num_frames, _ in chunks))
+        columns = {name: np.concatenate([chunk[name] for _, _, chunk in chunks]) for name, _ in COLUMNS}
+        columns['video'] = np.full(len(columns['frame']), video_id, dtype=np.int16)
+        results.append(columns)
+
+    elapsed = (datetime.now() - start).total_seconds()
+    print("{frames} frames processed in {elapsed:.1f}s ({fps:.1f} FPS).".format(
+        frames=sum(frame_counts), elapsed=elapsed, fps=sum(frame_counts) / max(elapsed, 1e-6)))
+
+    # One array per column, videos are referenced by their index in the videos array.
+    np.savez_compressed(args.output, videos=np.array(names), video_frames=np.array(frame_counts, dtype=np.int32),
+                        **{name: np.concatenate([result[name] for result in results])
+                           for name in ['video'] + [column for column, _ in COLUMNS]})
+    print("Detections saved in {output}.".format(output=args.output))
+
+
+if __name__ == "__main__":
+    main()
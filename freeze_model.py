@@ -6,6 +6,18 @@
     ======================
 
     Exports/Freezes training checkpoints for future detections.
+    The exported graph can be optimized for inference, its latency is then compared on CPU with the exported one.
+    The checkpoint can also be converted to a full-integer quantized TFLite model, compared with the float model on
+    the test split.
+
+    Usage:
+        freeze_model.py [--optimize --input-size 300x300 --tflite]
+
+    Options:
+        optimize (bool): Also write optimized_inference_graph.pb next to the exported graph.
+        input-size (str): Fixed input size WIDTHxHEIGHT of the optimized graph or of the TFLite model.
+        tflite (bool): Also write an int8 detect.tflite next to the exported graph, requires Tensorflow 1.15 while
+                       1.13 is pinned in requirements.txt.
 """
 
 import tensorflow as tf
@@ -13,7 +25,11 @@ import tensorflow as tf
 from utils import *
 from config import *
 from argparse import ArgumentParser
-from object_detection import exporter
+from cam_utils import parse_size
+from model_utils import TensorflowBackend, TFLiteBackend, load_sample_images, measure_latency, \
+    optimize_frozen_graph, quantize_tflite_graph
+from tfrecord_utils import read_record_images
+from object_detection import exporter, export_tflite_ssd_graph_lib
 from google.protobuf import text_format
 from object_detection.protos import pipeline_pb2
 
@@ -40,11 +56,125 @@ parser.add_argument("--config-override", type=str, default="",
 parser.add_argument("--write-inference-graph", type=bool, default=False,
                     help="Write inference graph to disk, default is {default}.".format(
                         default=False))
+parser.add_argument("--optimize", dest="optimize",
+                    action="store_true",
+                    help="Write an inference-optimized graph next to the exported one, default is {default}.".format(
+                        default=False))
+parser.add_argument("--input-size", dest="input_size",
+                    type=parse_size,
+                    default=None,
+                    help="Fixed input size WIDTHxHEIGHT of the optimized graph or of the TFLite model, default is "
+                         "{default}.".format(default=None))
+parser.add_argument("--tflite", dest="tflite",
+                    action="store_true",
+                    help="Write an int8 quantized TFLite model next to the exported graph, default is {default}."
+                    .format(default=False))
 args = parser.parse_args()
 
 
 # slim = tf.contrib.slim
 
+def compare_graphs(paths, images):
+    """
+    Prints the size and CPU latency of frozen graphs.
+    :param paths: frozen graph path by name.
+    :param images: sample images.
+    :return: void.
+    """
+    for name, path in paths:
+        # Single-threaded session so that both graphs are compared on the same footing.
+        model = TensorflowBackend(path, intra_op_threads=1, inter_op_threads=1, cpu_only=True)
+        latencies = np.array(measure_latency(model, images)) * 1000
+        model.close()
+
+        print("{name}: {size:.1f} MB, {median:.1f} ms median, {p95:.1f} ms p95 latency on {count} images.".format(
+            name=name, size=os.path.getsize(path) / 2 ** 20, median=np.median(latencies),
+            p95=np.percentile(latencies, 95), count=len(images)))
+
+
+def optimize(frozen_path):
+    """
+    Writes an inference-optimized copy of the exported graph and compares both.
+    :param frozen_path: exported graph path.
+    :return: void.
+    """
+    # Strip training leftovers and fold constants, the input shape may be fixed as well.
+    optimized_path = os.path.join(args.output_directory, os.path.basename(OPTIMIZED_MODEL_PATH))
+    input_shape = (-1, args.input_size[1], args.input_size[0], 3) if args.input_size else None
+    nodes, optimized_nodes = optimize_frozen_graph(frozen_path, optimized_path, input_shape=input_shape)
+    print("Optimized graph saved in {path}, {nodes} nodes instead of {before}.".format(
+        path=optimized_path, nodes=optimized_nodes, before=nodes))
+
+    # Compare on dataset images, resized when the input shape is fixed.
+    images = load_sample_images(size=args.input_size)
+    if not images:
+        print("No sample images in {dir}, latency comparison skipped.".format(dir=ROIS_PATH))
+        return
+    compare_graphs([("Exported graph", frozen_path), ("Optimized graph", optimized_path)], images)
+
+
+def export_quantized(pipeline_config, checkpoint, frozen_path, config=DETECTION_CONFIG["quantization"]):
+    """
+    Converts a checkpoint to a full-integer TFLite model calibrated on the test split, then compares it with the
+    float model.
+    :param pipeline_config: model pipeline configuration.
+    :param checkpoint: checkpoint prefix.
+    :param frozen_path: exported float graph path.
+    :param config: quantization configuration, see DETECTION_CONFIG['quantization'].
+    :return: void.
+    """
+    # Int8 inputs and the representative dataset of the converter came with Tensorflow 1.15.
+    if parse_version(tf.__version__) < parse_version("1.15"):
+        print("Quantized export requires Tensorflow 1.15, {version} is installed.".format(version=tf.__version__))
+        return
+
+    # TFLite needs a fixed input size, the one the model was trained at by default. The input placeholder and the
+    # anchors are built from the resizer, which is overridden on a copy of the configuration.
+    tflite_config = pipeline_pb2.TrainEvalPipelineConfig()
+    tflite_config.CopyFrom(pipeline_config)
+    resizer = tflite_config.model.ssd.image_resizer.fixed_shape_resizer
+    input_size = args.input_size or (resizer.width, resizer.height)
+    resizer.width, resizer.height = input_size
+
+    # Export a graph ending with the TFLite detection postprocess operation.
+    export_tflite_ssd_graph_lib.export_tflite_graph(tflite_config, checkpoint, args.output_directory,
+                                                    add_postprocessing_op=True,
+                                                    max_detections=DETECTION_CONFIG["max_detections"],
+                                                    max_classes_per_detection=1)
+    tflite_path = os.path.join(args.output_directory, os.path.basename(TFLITE_MODEL_PATH))
+    quantize_tflite_graph(os.path.join(args.output_directory, "tflite_graph.pb"), tflite_path, input_size,
+                          lambda: read_record_images("test", count=config["num_calibration"]))
+    print("Quantized model saved in {path}.".format(path=tflite_path))
+
+    images = list(read_record_images("test", count=config["num_eval"]))
+    if not images:
+        print("No test records in {dir}, comparison skipped.".format(dir=TFRECORDS_DIR))
+        return
+
+    # Both models run single-threaded on CPU.
+    min_score = SCORE_TRESH[DETECTION_CONFIG["default_thresh"]]
+    models = [("Float model", frozen_path, TensorflowBackend(frozen_path, 1, 1, cpu_only=True)),
+              ("Quantized model", tflite_path, TFLiteBackend(tflite_path, 1))]
+    detections = []
+    for name, path, model in models:
+        latencies = np.array(measure_latency(model, images)) * 1000
+        print("{name}: {size:.1f} MB, {median:.1f} ms median, {p95:.1f} ms p95 latency on {count} images.".format(
+            name=name, size=os.path.getsize(path) / 2 ** 20, median=np.median(latencies),
+            p95=np.percentile(latencies, 95), count=len(images)))
+
+        outputs = [model.detect(image[np.newaxis]) for image in images]
+        detections.append([get_detection_array(boxes[0], classes[0].astype(np.int32), scores[0], min_score)
+                           for (boxes, scores, classes, _) in outputs])
+        model.close()
+
+    agreement = np.mean([detection_agreement(reference, candidate, config["iou"])
+                         for reference, candidate in zip(*detections)])
+    print("Detection agreement: {agreement:.1%} ({delta:.1%} delta), {float} float and {quantized} quantized "
+          "detections above {min_score}.".format(agreement=agreement, delta=1 - agreement,
+                                                 float=sum(map(len, detections[0])),
+                                                 quantized=sum(map(len, detections[1])), min_score=min_score))
+
+
 def main(_):
     """
     Main program.
@@ -54,13 +184,13 @@ def main(_):
 
     # Retrieve latest checkpoint prefix.
     pipeline_config = pipeline_pb2.TrainEvalPipelineConfig()
-    latest_checkpoint = find_latest_checkpoint(dir=CHECKPOINTS_DIR, prefix=args.checkpoints_prefix)
+    latest_checkpoint = find_latest_checkpoint(dir=CHECKPOINTS_DIR, prefix=args.checkpoint_prefix)
 
     if latest_checkpoint is None:
         return
 
     # Read model config file.
-    with tf.gfile.GFile(args.config_file, 'r') as f:
+    with tf.gfile.GFile(args.config_path, 'r') as f:
         text_format.Merge(f.read(), pipeline_config)
 
     # Override config file if any updates are provided.
@@ -70,6 +200,12 @@ def main(_):
     exporter.export_inference_graph(
         args.input_type, pipeline_config, latest_checkpoint,
         args.output_directory, write_inference_graph=args.write_inference_graph)
+    frozen_path = os.path.join(args.output_directory, os.path.basename(FROZEN_MODEL_PATH))
+
+    if args.optimize:
+        optimize(frozen_path)
+    if args.tflite:
+        export_quantized(pipeline_config, latest_checkpoint, frozen_path)
 
 
 if __name__ == "__main__":
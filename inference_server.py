@@ -0,0 +1,264 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Inference server.
+    ======================
+    Keeps a detection model loaded and serves local clients, frames of all clients are batched together.
+    Scripts use it with --backend remote.
+
+    Usage:
+        inference_server.py [--address unix:training/outputs/inference.sock --backend tensorflow --num-workers 1
+                             --batch-size 8 --batch-timeout 5]
+
+    Options:
+        address (str): Listening address, 'unix:path/to/socket' or 'tcp:host:port'.
+        backend (str): Inference backend, 'tensorflow', 'tflite' or 'opencv'.
+        num-workers (int): Number of batches processed at the same time.
+        batch-size (int): Maximum number of frames processed at once.
+        batch-timeout (int): Maximum time (ms) to wait for a batch to fill.
+"""
+
+import time
+import socket
+
+from utils import *
+from config import *
+from queue import Queue as LocalQueue
+from threading import Event, Lock, Thread
+from argparse import ArgumentParser
+from collections import OrderedDict
+from model_utils import BACKENDS
+from pipeline_utils import get_batch, load_model, plan_cpus
+from server_utils import decode_frames, encode_results, parse_address, recv_message, send_message
+
+__description__ = "Keeps a detection model loaded and serves local clients."
+
+# Parse args.
+parser = ArgumentParser(description=__description__)
+
+parser.add_argument("-a", "--address", dest="address",
+                    type=str,
+                    default=DETECTION_CONFIG["server"]["address"],
+                    help="Listening address, default is {default}.".format(
+                        default=DETECTION_CONFIG["server"]["address"]))
+
+parser.add_argument("--backend", dest="backend",
+                    type=str,
+                    choices=[backend for backend in BACKENDS.keys() if backend != "remote"],
+                    default=DETECTION_CONFIG["server"]["backend"],
+                    help="Inference backend, default is {default}.".format(
+                        default=DETECTION_CONFIG["server"]["backend"]))
+
+parser.add_argument('-num-w', '--num-workers', dest='num_workers',
+                    type=int,
+                    default=DETECTION_CONFIG["server"]["num_workers"],
+                    help='Number of batches processed at the same time, default is {default}.'.format(
+                        default=DETECTION_CONFIG["server"]["num_workers"]))
+
+parser.add_argument("-b-size", "--batch-size", dest="batch_size",
+                    type=int,
+                    default=DETECTION_CONFIG["server"]["batch_size"],
+                    help="Maximum number of frames processed at once, default is {default}.".format(
+                        default=DETECTION_CONFIG["server"]["batch_size"]))
+
+parser.add_argument("-b-timeout", "--batch-timeout", dest="batch_timeout",
+                    type=int,
+                    default=DETECTION_CONFIG["server"]["batch_timeout"],
+                    help="Maximum time (ms) to wait for a batch to fill, default is {default}.".format(
+                        default=DETECTION_CONFIG["server"]["batch_timeout"]))
+
+args = parser.parse_args()
+
+
+class PendingRequest(object):
+    """
+    Class to gather the detections of the frames of a request, which may be processed in different batches.
+    """
+
+    def __init__(self, frames):
+        """
+        Initializes a request without detections.
+        :param frames: request frames.
+        """
+        self.frames = frames
+        self.detections = [None] * len(frames)
+        self.error = None
+        self._remaining = len(frames)
+        self._lock = Lock()
+        self._done = Event()
+
+    def set(self, index, detections=None, error=None):
+        """
+        Stores the detections of a frame, the request is done once every frame has been processed.
+        :param index: frame index.
+        :param detections: boxes, scores, classes and number of detections of the frame.
+        :param error: error message if the frame couldn't be processed.
+        :return: void.
+        """
+        with self._lock:
+            self.detections[index] = detections
+            self.error = self.error or error
+            self._remaining -= 1
+            if not self._remaining:
+                self._done.set()
+
+    def wait(self):
+        """
+        Waits for every frame to be processed.
+        :return: void.
+        """
+        self._done.wait()
+
+
+class ServerStats(object):
+    """
+    Class to count served requests, frames and batches.
+    """
+
+    def __init__(self):
+        """
+        Initializes the counters.
+        """
+        self.clients = self.requests = self.frames = self.batches = 0
+        self._lock = Lock()
+
+    def add(self, **counts):
+        """
+        Increments counters.
+        :param counts: increment of each counter.
+        :return: void.
+        """
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+
+def serve_batches(model, frames_q, stats):
+    """
+    Runs the model on the queued frames of all clients forever.
+    :param model: detection model.
+    :param frames_q: queued frames as (request, index) pairs.
+    :param stats: server counters.
+    :return: void.
+    """
+    while True:
+        items = get_batch(frames_q, args.batch_size, args.batch_timeout)
+
+        # Frames of different sizes can't be stacked in the same batch.
+        batches = OrderedDict()
+        for request, index in items:
+            try:
+                batches.setdefault(request.frames[index].shape, []).append((request, index))
+            except Exception as ee:
+                request.set(index, error=str(ee))
+
+        for batch in batches.values():
+            # Clients wait for every frame, any failure must be reported to all the requests of the batch.
+            try:
+                (boxes, scores, classes, num) = model.detect(np.stack([request.frames[index]
+                                                                       for request, index in batch]))
+            except Exception as ee:
+                for request, index in batch:
+                    request.set(index, error=str(ee))
+                continue
+
+            for i, (request, index) in enumerate(batch):
+                request.set(index, (boxes[i], scores[i], classes[i], num[i]))
+            stats.add(batches=1, frames=len(batch))
+
+
+def handle_client(connection, frames_q, stats):
+    """
+    Answers the requests of a client until it disconnects.
+    :param connection: client socket.
+    :param frames_q: queued frames as (request, index) pairs.
+    :param stats: server counters.
+    :return: void.
+    """
+    stats.add(clients=1)
+
+    with connection:
+        while True:
+            try:
+                message = recv_message(connection)
+                if message is None:
+                    break
+
+                # Each frame is queued on its own so that frames of several clients share batches.
+                request = PendingRequest(decode_frames(*message))
+                if not request.frames:
+                    send_message(connection, {'error': 'Empty request'})
+                    continue
+                if any(frame is None for frame in request.frames):
+                    send_message(connection, {'error': 'Invalid request: undecodable frame'})
+                    continue
+                for index in range(len(request.frames)):
+                    frames_q.put((request, index))
+                request.wait()
+                stats.add(requests=1)
+
+                if request.error is not None:
+                    send_message(connection, {'error': request.error})
+                else:
+                    send_message(connection, *encode_results(request.detections))
+            except OSError:
+                break
+            except (KeyError, ValueError) as ee:
+                send_message(connection, {'error': 'Invalid request: {error}'.format(error=ee)})
+
+
+def main():
+    """
+    Main program.
+    :return: void.
+    """
+    # Load the model once, worker threads share it if the backend allows it.
+    cpu_plan = plan_cpus(args.num_workers, "thread")
+    start = time.time()
+    models = [load_model(cpu_plan, args.backend)]
+    if not BACKENDS[args.backend].thread_safe:
+        models += [load_model(cpu_plan, args.backend) for _ in range(args.num_workers - 1)]
+    print("{backend} model loaded in {seconds:.1f}s.".format(backend=args.backend, seconds=time.time() - start))
+
+    frames_q = LocalQueue()
+    stats = ServerStats()
+    for i in range(args.num_workers):
+        Thread(target=serve_batches, args=(models[i % len(models)], frames_q, stats), daemon=True).start()
+
+    # A previous server may have left its socket file behind.
+    family, address = parse_address(args.address)
+    if family == socket.AF_UNIX and os.path.exists(address):
+        os.remove(address)
+
+    server = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(address)
+    server.listen()
+    print("Listening on {address}.".format(address=args.address))
+
+    # Serve clients until Ctrl+C.
+    try:
+        while True:
+            connection, _ = server.accept()
+            if family == socket.AF_INET:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            Thread(target=handle_client, args=(connection, frames_q, stats), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+
+    # End program properly.
+    server.close()
+    if family == socket.AF_UNIX:
+        os.remove(address)
+    for model in models:
+        model.close()
+
+    print("{clients} clients, {requests} requests, {frames} frames in {batches} batches ({size:.1f} frames per "
+          "batch).".format(clients=stats.clients, requests=stats.requests, frames=stats.frames, batches=stats.batches,
+                           size=stats.frames / max(1, stats.batches)))
+
+
+if __name__ == "__main__":
+    main()
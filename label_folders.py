@@ -9,11 +9,11 @@
 """
 
 import pandas as pd
-import tensorflow as tf
 
 from utils import *
 from config import *
 from argparse import ArgumentParser
+from model_utils import BACKENDS, create_model
 from object_detection.utils import label_map_util
 
 __description__ = "Pre-annotates folders using AI model."
@@ -37,6 +37,12 @@ parser.add_argument("-max-b", "--max-boxes", dest='max_boxes',
                     help="Max number of boxes to draw at a time, default is {default}.".format(
                         default=DETECTION_CONFIG["max_boxes_to_draw"]))
 
+parser.add_argument("--backend", dest="backend",
+                    type=str,
+                    choices=list(BACKENDS.keys()),
+                    default=DETECTION_CONFIG["backend"],
+                    help="Inference backend, default is {default}.".format(default=DETECTION_CONFIG["backend"]))
+
 args = parser.parse_args()
 
 # Load labelmap file.
@@ -45,17 +51,14 @@ categories = label_map_util.convert_label_map_to_categories(label_map, max_num_c
                                                             use_display_name=True)
 category_index = label_map_util.create_category_index(categories)
 
-# Loads a frozen Tensorflow model in memory.
-detection_graph = tf.Graph()
-with detection_graph.as_default():
-    od_graph_def = tf.GraphDef()
-    with tf.gfile.GFile(FROZEN_MODEL_PATH, 'rb') as fid:
-        serialized_graph = fid.read()
-        od_graph_def.ParseFromString(serialized_graph)
-        tf.import_graph_def(od_graph_def, name='')
-
 
-def detect_items(image_path, session):
+def detect_items(image_path, model):
+    """
+    Detects items on an image.
+    :param image_path: image path.
+    :param model: detection model.
+    :return: detected items.
+    """
     # Read input image.
     try:
         image = cv.imread(image_path)
@@ -63,30 +66,20 @@ def detect_items(image_path, session):
         print(ee)
         return
 
-    # Expand image.
-    image_np_expanded = np.expand_dims(image, axis=0)
-    image_tensor = detection_graph.get_tensor_by_name("image_tensor:0")
-
     # Retrieve boxes, scores, classes and number of detections.
-    boxes = detection_graph.get_tensor_by_name("detection_boxes:0")
-    scores = detection_graph.get_tensor_by_name("detection_scores:0")
-    classes = detection_graph.get_tensor_by_name("detection_classes:0")
-    num_detections = detection_graph.get_tensor_by_name("num_detections:0")
-
-    # Actual detection.
-    (boxes, scores, classes, num_detections) = session.run([boxes, scores, classes, num_detections],
-                                                           feed_dict={image_tensor: image_np_expanded})
+    (boxes, scores, classes, num_detections) = model.detect(np.expand_dims(image, axis=0))
 
     return get_detection_boxes(boxes=np.squeeze(boxes), classes=np.squeeze(classes).astype(np.int32),
                                scores=np.squeeze(scores), category_index=category_index,
                                tresh_level=args.min_confidence, max_boxes_to_draw=args.max_boxes)
 
 
-def annotate_folder(folder_path):
+def annotate_folder(folder_path, model):
     """
-
-    :param folder_path:
-    :return:
+    Pre-annotates the frames of a folder.
+    :param folder_path: folder path.
+    :param model: detection model.
+    :return: annotations as a dataframe.
     """
     csv_path = os.path.join(folder_path, "roi_{folder}.csv".format(folder=os.path.basename(folder_path)))
 
@@ -103,37 +96,36 @@ def annotate_folder(folder_path):
         return
 
     # Detect items on each frame.
-    with tf.Session(graph=detection_graph) as sess:
-        new_df = pd.DataFrame()
-        for index, row in df.iterrows():
-            detections = detect_items(image_path=os.path.join(folder_path, row["Path"]), session=sess)
-            if not detections:
+    new_df = pd.DataFrame()
+    for index, row in df.iterrows():
+        detections = detect_items(image_path=os.path.join(folder_path, row["Path"]), model=model)
+        if not detections:
+            new_df = new_df.append({
+                "Path": row["Path"],
+                "Class": "",
+                "Xmin": "",
+                "Ymin": "",
+                "Xmax": "",
+                "Ymax": "",
+                "Confidence": "",
+                "Is_occluded": "",
+                "Is_truncated": "",
+                "Is_depiction": ""
+            }, ignore_index=True)
+        else:
+            for detection in detections:
                 new_df = new_df.append({
                     "Path": row["Path"],
-                    "Class": "",
-                    "Xmin": "",
-                    "Ymin": "",
-                    "Xmax": "",
-                    "Ymax": "",
-                    "Confidence": "",
-                    "Is_occluded": "",
-                    "Is_truncated": "",
-                    "Is_depiction": ""
+                    "Class": detection["class"],
+                    "Xmin": detection["box"]["xmin"],
+                    "Ymin": detection["box"]["ymin"],
+                    "Xmax": detection["box"]["xmax"],
+                    "Ymax": detection["box"]["ymax"],
+                    "Confidence": detection["confidence"],
+                    "Is_occluded": False,
+                    "Is_truncated": False,
+                    "Is_depiction": False
                 }, ignore_index=True)
-            else:
-                for detection in detections:
-                    new_df = new_df.append({
-                        "Path": row["Path"],
-                        "Class": detection["class"],
-                        "Xmin": detection["box"]["xmin"],
-                        "Ymin": detection["box"]["ymin"],
-                        "Xmax": detection["box"]["xmax"],
-                        "Ymax": detection["box"]["ymax"],
-                        "Confidence": detection["confidence"],
-                        "Is_occluded": False,
-                        "Is_truncated": False,
-                        "Is_depiction": False
-                    }, ignore_index=True)
 
     # Force dataset indexation.
     return new_df.reindex(columns=CSV_STRUCTURE['annotation'])
@@ -144,9 +136,12 @@ def main():
     Main program.
     :return: void.
     """
+    # Load the model once for all folders.
+    model = create_model(args.backend)
+
     for folder_path in list_directories(FOLDERS_DIR):
         # Retrieve annotated folder as a dataframe.
-        df = annotate_folder(folder_path)
+        df = annotate_folder(folder_path, model)
 
         # Save dataframe as CSV if not empty.
         if df is not None:
@@ -155,6 +150,8 @@ def main():
         else:
             print("No detections / Missing files.")
 
+    model.close()
+
 
 if __name__ == "__main__":
     main()
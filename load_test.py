@@ -0,0 +1,449 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Pipeline load test.
+    ======================
+    Drives the live detection pipeline of detect_items.py with synthetic or recorded cameras instead of capture
+    devices: the real queues and workers run for a fixed duration while throughput, latency and resources are measured.
+    The autotune mode runs a load test per setting and saves the best one as the machine profile detect_items.py
+    loads at startup.
+
+    Usage:
+        load_test.py [--cameras 1 --resolution 1280x720 --fps 30 --recordings a.mp4 b.mp4 --warmup 10 --duration 60
+                      --output training/outputs/load_test.json --autotune --target-latency 200 --target-fps 30]
+                     [detect_items.py options]
+
+    Options:
+        cameras (int): Number of simulated cameras.
+        resolution (str): Frames size WIDTHxHEIGHT.
+        fps (int): Framerate of each camera.
+        recordings (str): Video files replayed in a loop by the cameras, synthetic frames if not set.
+        warmup (int): Time (s) ignored after the first detections, while workers warm up.
+        duration (int): Measurement duration (s).
+        startup-timeout (int): Maximum time (s) to wait for the first detections.
+        output (str): Output report file.
+        autotune (bool): Sweep settings and save the best ones as the machine profile.
+        target-latency (int): Autotune for the highest throughput within this p95 latency (ms).
+        target-fps (float): Autotune for the lowest latency sustaining this framerate, the cameras framerate by default.
+    Remaining options are passed to detect_items.py, which always runs headless.
+"""
+
+import sys
+import json
+import time
+import signal
+import psutil
+import importlib
+import subprocess
+
+from utils import *
+from config import *
+from threading import Lock, Thread, Timer
+from argparse import ArgumentParser
+from sink_utils import CallbackSink
+from metrics_utils import PERCENTILES
+from profile_utils import save_profile
+from cam_utils import open_stream, parse_size
+
+__description__ = "Drives the live detection pipeline with synthetic or recorded cameras."
+
+# Parse args, unknown ones are meant for detect_items.py.
+parser = ArgumentParser(description=__description__)
+
+parser.add_argument("-c", "--cameras", dest="cameras",
+                    type=int,
+                    default=1,
+                    help="Number of simulated cameras, default is {default}.".format(default=1))
+
+parser.add_argument("-r", "--resolution", dest="resolution",
+                    type=parse_size,
+                    default="{width}x{height}".format(**INPUT_RESOLUTION[DEVICE_CONFIG["resolution"]]),
+                    help="Frames size WIDTHxHEIGHT, default is {default}.".format(
+                        default="{width}x{height}".format(**INPUT_RESOLUTION[DEVICE_CONFIG["resolution"]])))
+
+parser.add_argument("--fps", dest="fps",
+                    type=int,
+                    default=30,
+                    help="Framerate of each camera, default is {default}.".format(default=30))
+
+parser.add_argument("--recordings", dest="recordings",
+                    type=str,
+                    nargs="+",
+                    default=None,
+                    help="Video files replayed in a loop by the cameras, default is synthetic frames.")
+
+parser.add_argument("-w", "--warmup", dest="warmup",
+                    type=int,
+                    default=10,
+                    help="Time (s) ignored after the first detections, default is {default}.".format(default=10))
+
+parser.add_argument("-d", "--duration", dest="duration",
+                    type=int,
+                    default=60,
+                    help="Measurement duration (s), default is {default}.".format(default=60))
+
+parser.add_argument("--startup-timeout", dest="startup_timeout",
+                    type=int,
+                    default=300,
+                    help="Maximum time (s) to wait for the first detections, default is {default}.".format(
+                        default=300))
+
+parser.add_argument("-o", "--output", dest="output",
+                    type=str,
+                    default=os.path.join(OUTPUTS_DIR, "load_test.json"),
+                    help="Output report file, default is {default}.".format(
+                        default=os.path.join(OUTPUTS_DIR, "load_test.json")))
+
+parser.add_argument("--autotune", dest="autotune",
+                    action="store_true",
+                    help="Sweep workers, queue size, quality and threads and save the best ones as the machine "
+                         "profile, default is {default}.".format(default=False))
+
+parser.add_argument("--target-latency", dest="target_latency",
+                    type=int,
+                    default=None,
+                    help="Autotune for the highest throughput within this p95 latency (ms), default is {default}."
+                    .format(default=None))
+
+parser.add_argument("--target-fps", dest="target_fps",
+                    type=float,
+                    default=None,
+                    help="Autotune for the lowest latency sustaining this framerate, default is the cameras "
+                         "framerate.")
+
+args, pipeline_args = parser.parse_known_args()
+
+
+def start_timer(interval, function):
+    """
+    Calls a function after a delay, unless the program ended.
+    :param interval: delay in seconds.
+    :param function: function to call.
+    :return: void.
+    """
+    timer = Timer(interval, function)
+    timer.daemon = True
+    timer.start()
+
+
+def get_sources():
+    """
+    Builds the video sources of the simulated cameras.
+    :return: list of source specifications, see cam_utils.parse_source.
+    """
+    if args.recordings:
+        return ["replay:{path}@{fps}".format(path=args.recordings[i % len(args.recordings)], fps=args.fps)
+                for i in range(args.cameras)]
+    return ["synthetic:{seed}@{fps}".format(seed=i, fps=args.fps) for i in range(args.cameras)]
+
+
+class LoadTest(object):
+    """
+    Class to measure the pipeline from the outside: cameras count produced frames, the sink timestamps emitted ones
+    and a monitor Thread samples CPU and memory over the measurement window.
+    """
+
+    def __init__(self):
+        """
+        Initializes an idle test.
+        """
+        self.streams = []
+        self.latencies = []
+        self.emitted = [0] * args.cameras
+        self.produced = None
+        self.samples = []
+        self.first = self.started = self.ended = None
+        self._lock = Lock()
+
+    def create_stream(self, spec, width, height, **options):
+        """
+        Opens a simulated camera at the test resolution, used in place of cam_utils.open_stream.
+        :param spec: video source, see get_sources.
+        :param width: ignored, the test resolution is used.
+        :param height: ignored, the test resolution is used.
+        :param options: other WebcamVideoStream options.
+        :return: stream.
+        """
+        stream = open_stream(spec, *args.resolution, **options)
+        self.streams.append(stream)
+        return stream
+
+    def record(self, record):
+        """
+        Receives the detections of a frame, the measurement starts after the warmup following the first frame.
+        :param record: frame detections.
+        :return: void.
+        """
+        now = time.time()
+        with self._lock:
+            if self.first is None:
+                self.first = now
+                start_timer(args.warmup, self.start)
+                start_timer(args.warmup + args.duration, self.stop)
+
+            if self.started is not None and self.ended is None:
+                self.latencies.append(now - record["timestamp"])
+                self.emitted[record["source"]] += 1
+
+    def start(self):
+        """
+        Starts the measurement window.
+        :return: void.
+        """
+        with self._lock:
+            if self.ended is not None:
+                return
+            self.produced = [stream.count for stream in self.streams]
+            self.started = time.time()
+        Thread(target=self.monitor, daemon=True).start()
+
+    def finish(self):
+        """
+        Ends the measurement window.
+        :return: False if it already ended, True otherwise.
+        """
+        with self._lock:
+            if self.ended is not None:
+                return False
+            self.ended = time.time()
+            if self.produced is not None:
+                self.produced = [stream.count - count for stream, count in zip(self.streams, self.produced)]
+            return True
+
+    def stop(self):
+        """
+        Ends the measurement window and stops the pipeline as Ctrl+C would.
+        :return: void.
+        """
+        if self.finish():
+            os.kill(os.getpid(), signal.SIGINT)
+
+    def timeout(self):
+        """
+        Stops the pipeline if no frame came out of it in time.
+        :return: void.
+        """
+        if self.first is None:
+            print("No detections after {timeout}s, stopping.".format(timeout=args.startup_timeout))
+            self.stop()
+
+    def monitor(self):
+        """
+        Samples the CPU usage and memory of the pipeline and its worker processes.
+        :return: void.
+        """
+        processes = {}
+        while self.ended is None:
+            current = psutil.Process()
+            cpu = 0
+            for process in [current] + current.children(recursive=True):
+                try:
+                    # The first measure of a process only starts its counter.
+                    cpu += processes.setdefault(process.pid, process).cpu_percent()
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    pass
+            self.samples.append((cpu, memory_usage()))
+            time.sleep(1)
+
+    def report(self, metrics):
+        """
+        Summarizes the measurement window.
+        :param metrics: pipeline metrics dumped by detect_items.py.
+        :return: report as dictionary.
+        """
+        window = self.ended - self.started
+        latencies = np.array(self.latencies)
+        cpu, memory = (np.array(values) for values in zip(*self.samples[1:])) if len(self.samples) > 1 else \
+            (np.zeros(1), np.zeros(1))
+        gauges = [source["gauges"] for source in metrics]
+        produced = sum(self.produced)
+
+        return {
+            "cameras": args.cameras,
+            "resolution": "{width}x{height}".format(width=args.resolution[0], height=args.resolution[1]),
+            "fps": args.fps,
+            "source": args.recordings or "synthetic",
+            "pipeline_args": pipeline_args,
+            "duration": window,
+            "camera_fps": produced / window,
+            "sustained_fps": sum(self.emitted) / window,
+            "sources_fps": [count / window for count in self.emitted],
+            # Frames the cameras produced during the window which never came out of the pipeline, whether the capture
+            # thread missed them, the admission policy dropped them or the reorder buffer gave up on them.
+            "drop_rate": max(0., 1 - sum(self.emitted) / produced) if produced else 0.,
+            # Breakdown over the whole run, warmup included.
+            "lost_frames": {kind: sum(source[kind + "_frames"] for source in gauges)
+                            for kind in ("missed", "dropped", "late")},
+            "latency": dict({"p{p}".format(p=p): float(np.percentile(latencies, p)) if len(latencies) else None
+                             for p in PERCENTILES}, mean=float(latencies.mean()) if len(latencies) else None),
+            "cpu_percent": {"mean": float(cpu.mean()), "max": float(cpu.max())},
+            "memory": {"mean": float(memory.mean()), "peak": float(memory.max())}
+        }
+
+
+def run():
+    """
+    Runs a single load test.
+    :return: void.
+    """
+    test = LoadTest()
+    metrics_path = os.path.join(OUTPUTS_DIR, "load_test_metrics.json")
+
+    # detect_items.py parses its arguments when imported, cameras are opened at the test resolution and the sink is
+    # swapped for the test one.
+    sys.argv = ["detect_items.py", "--headless", "--video-source"] + get_sources() + [
+        "--sink", "jsonl:" + os.devnull, "--metrics-path", metrics_path] + pipeline_args
+    detect_items = importlib.import_module("detect_items")
+    detect_items.open_stream = test.create_stream
+    detect_items.create_sink = lambda spec: CallbackSink(test.record)
+
+    start_timer(args.startup_timeout, test.timeout)
+    detect_items.main()
+
+    # The pipeline may also have been stopped by hand.
+    test.finish()
+    if test.started is None:
+        print("The pipeline stopped before the end of the warmup, no report.")
+        return
+
+    with open(metrics_path) as f:
+        report = test.report(json.load(f))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print("{cameras} cameras at {fps} FPS ({camera_fps:.1f} FPS produced): {sustained_fps:.1f} FPS sustained, "
+          "{drop_rate:.1%} dropped.".format(**report))
+    if report["latency"]["p50"] is not None:
+        print("End-to-end latency: {p50:.0f} ms p50, {p95:.0f} ms p95, {p99:.0f} ms p99.".format(
+            **{key: value * 1000 for key, value in report["latency"].items()}))
+    print("CPU: {mean:.0f}% mean, {max:.0f}% max. Memory: {peak:.0f} MB peak.".format(
+        mean=report["cpu_percent"]["mean"], max=report["cpu_percent"]["max"], peak=report["memory"]["peak"] / 2 ** 20))
+    print("Report saved in {output}.".format(output=args.output))
+
+
+def run_trial(settings, config=DETECTION_CONFIG["autotune"]):
+    """
+    Runs a load test with the given settings in a new process, so that each trial starts from a clean state.
+    :param settings: quality, number of workers, queue size and intra-op threads.
+    :param config: autotune configuration, see DETECTION_CONFIG['autotune'].
+    :return: load test report, None if the trial failed.
+    """
+    output = os.path.join(OUTPUTS_DIR, "autotune_trial.json")
+    if os.path.exists(output):
+        os.remove(output)
+
+    resolution = INPUT_RESOLUTION[settings["quality"]]
+    command = [sys.executable, os.path.abspath(__file__), "--cameras", str(args.cameras), "--fps", str(args.fps),
+               "--resolution", "{width}x{height}".format(**resolution), "--warmup", str(config["warmup"]),
+               "--duration", str(config["duration"]), "--startup-timeout", str(args.startup_timeout),
+               "--output", output]
+    if args.recordings:
+        command += ["--recordings"] + args.recordings
+    command += pipeline_args + ["--quality", settings["quality"], "--num-workers", str(settings["num_workers"]),
+                                "--queue-size", str(settings["queue_size"]),
+                                "--intra-op-threads", str(settings["intra_op_threads"])]
+    subprocess.run(command, stdout=subprocess.DEVNULL)
+
+    if not os.path.exists(output):
+        return None
+    with open(output) as f:
+        return json.load(f)
+
+
+def score(settings, report, qualities):
+    """
+    Ranks a trial against the target: settings meeting it are ranked by quality then by the other objective,
+    others by how close they get to it.
+    :param settings: trial settings.
+    :param report: trial report.
+    :param qualities: qualities from the lowest to the highest.
+    :return: sortable score, the higher the better.
+    """
+    if report is None or report["latency"]["p95"] is None:
+        return 0, 0, -float("inf")
+
+    latency, fps = report["latency"]["p95"] * 1000, report["sustained_fps"]
+    if args.target_latency:
+        if latency <= args.target_latency:
+            return 1, qualities.index(settings["quality"]), fps
+        return 0, 0, -latency
+
+    # Sustaining the cameras framerate, up to measurement noise.
+    target_fps = args.target_fps or args.fps * args.cameras
+    if fps >= target_fps * .95:
+        return 1, qualities.index(settings["quality"]), -latency
+    return 0, 0, fps
+
+
+def autotune(config=DETECTION_CONFIG["autotune"]):
+    """
+    Sweeps the pipeline settings on the current machine and saves the best ones as the machine profile.
+    Workers and threads are swept first for each quality, from the highest, until a quality meets the target.
+    Queue sizes are then swept for the best settings.
+    :param config: autotune configuration, see DETECTION_CONFIG['autotune'].
+    :return: void.
+    """
+    cores = len(get_available_cores())
+    qualities = [quality for quality in INPUT_RESOLUTION.keys() if quality in config["qualities"]]
+    worker_counts = config["num_workers"] or [2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores]
+    trials = []
+
+    def trial(settings):
+        """
+        Runs and records a trial.
+        :param settings: trial settings.
+        :return: trial score.
+        """
+        report = run_trial(settings)
+        trials.append({"settings": settings, "report": report})
+        if report is None:
+            print("{settings}: failed.".format(settings=settings))
+        else:
+            print("{settings}: {fps:.1f} FPS, {latency} ms p95 latency, {drop_rate:.1%} dropped.".format(
+                settings=settings, fps=report["sustained_fps"], drop_rate=report["drop_rate"],
+                latency="{:.0f}".format(report["latency"]["p95"] * 1000) if report["latency"]["p95"] else "-"))
+        return score(settings, report, qualities)
+
+    best, best_score = None, None
+    for quality in reversed(qualities):
+        for num_workers in worker_counts:
+            for intra_op_threads in sorted({1, max(1, cores // num_workers)}):
+                settings = {"quality": quality, "num_workers": num_workers, "queue_size": max(2, num_workers * 2),
+                            "intra_op_threads": intra_op_threads}
+                settings_score = trial(settings)
+                if best_score is None or settings_score > best_score:
+                    best, best_score = settings, settings_score
+
+        # Lower qualities are only worth trying if this one can't meet the target.
+        if best_score[0]:
+            break
+
+    for queue_size in config["queue_sizes"]:
+        if queue_size != best["queue_size"]:
+            settings = dict(best, queue_size=queue_size)
+            settings_score = trial(settings)
+            if settings_score > best_score:
+                best, best_score = settings, settings_score
+
+    target = {"latency_p95_ms": args.target_latency} if args.target_latency else {
+        "fps": args.target_fps or args.fps * args.cameras}
+    if not best_score[0]:
+        print("No setting meets the target {target}, keeping the closest one.".format(target=target))
+    path = save_profile(best, dict(target, cameras=args.cameras), trials)
+    print("Best settings {settings} saved in {path}.".format(settings=best, path=path))
+
+
+def main():
+    """
+    Main program.
+    :return: void.
+    """
+    if args.autotune:
+        autotune()
+    else:
+        run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Metrics utils file.
+    ======================
+    Collection of useful classes to measure the detection pipeline performances.
+"""
+
+import json
+import time
+
+from utils import *
+from threading import Lock, Thread
+from collections import deque, OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Reported latency percentiles.
+PERCENTILES = (50, 95, 99)
+
+
+class PipelineMetrics(object):
+    """
+    Class to collect per-stage latencies and framerate over a rolling time window.
+    """
+
+    def __init__(self, window=DETECTION_CONFIG['metrics_window'], prefix='smartbin', labels=None):
+        """
+        Initializes empty metrics.
+        :param window: rolling window duration in seconds.
+        :param prefix: metrics names prefix.
+        :param labels: labels added to every exported metric, e.g. the capture source.
+        """
+        self.window = window
+        self.prefix = prefix
+        self.labels = OrderedDict(labels or {})
+        self.started = time.time()
+        self._samples = OrderedDict()
+        self._totals = {}
+        self._frames = deque()
+        self._frames_count = 0
+        self._gauges = OrderedDict()
+        self._lock = Lock()
+
+    def observe(self, stage, seconds, now=None):
+        """
+        Records the time spent by a frame in a stage.
+        :param stage: stage name.
+        :param seconds: duration in seconds.
+        :param now: observation time, defaults to time.time().
+        :return: void.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            samples = self._samples.setdefault(stage, deque())
+            samples.append((now, seconds))
+            total, count = self._totals.get(stage, (0., 0))
+            self._totals[stage] = (total + seconds, count + 1)
+            self._expire(samples, now)
+
+    def tick(self, now=None):
+        """
+        Counts a frame going out of the pipeline.
+        :param now: output time, defaults to time.time().
+        :return: void.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._frames.append((now, None))
+            self._frames_count += 1
+            self._expire(self._frames, now)
+
+    def gauge(self, name, description, function):
+        """
+        Registers a value read when metrics are exported, e.g. a counter of another component.
+        :param name: metric name without prefix.
+        :param description: metric description.
+        :param function: function returning the current value.
+        :return: void.
+        """
+        self._gauges[name] = (description, function)
+
+    def fps(self, now=None):
+        """
+        Computes the framerate over the rolling window.
+        :param now: current time, defaults to time.time().
+        :return: frames per second.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire(self._frames, now)
+            span = min(self.window, now - self.started)
+            return len(self._frames) / span if span > 0 else 0.
+
+    def percentiles(self, stage, now=None):
+        """
+        Computes latency percentiles of a stage over the rolling window.
+        :param stage: stage name.
+        :param now: current time, defaults to time.time().
+        :return: dictionary of percentile to seconds, empty if the stage has no sample.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            samples = self._samples.get(stage, deque())
+            self._expire(samples, now)
+            values = [seconds for _, seconds in samples]
+
+        if not values:
+            return {}
+        return dict(zip(PERCENTILES, np.percentile(values, PERCENTILES).tolist()))
+
+    def summary(self):
+        """
+        Returns a snapshot of all the metrics.
+        :return: metrics as dictionary.
+        """
+        with self._lock:
+            stages = list(self._samples.keys())
+            totals = dict(self._totals)
+            frames_count = self._frames_count
+
+        return {
+            'uptime': time.time() - self.started,
+            'frames': frames_count,
+            'fps': self.fps(),
+            'stages': {stage: {
+                'count': totals[stage][1],
+                'mean': totals[stage][0] / totals[stage][1],
+                'percentiles': {'p{p}'.format(p=p): value for p, value in self.percentiles(stage).items()}
+            } for stage in stages},
+            'gauges': {name: function() for name, (_, function) in self._gauges.items()}
+        }
+
+    def _expire(self, samples, now):
+        """
+        Removes samples older than the rolling window, must be called with the lock held.
+        :param samples: samples deque.
+        :param now: current time.
+        :return: void.
+        """
+        while samples and now - samples[0][0] > self.window:
+            samples.popleft()
+
+
+def format_labels(labels):
+    """
+    Formats Prometheus labels.
+    :param labels: labels as (name, value) pairs.
+    :return: labels as string, empty if there is no label.
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join('{name}="{value}"'.format(name=name, value=value) for name, value in labels) + '}'
+
+
+def export_prometheus(metrics_list):
+    """
+    Exports several pipeline metrics in the Prometheus text format, each metric family is described once.
+    Metrics are told apart by their labels.
+    :param metrics_list: list of pipeline metrics sharing the same prefix.
+    :return: metrics as string.
+    """
+    prefix, window = metrics_list[0].prefix, metrics_list[0].window
+    families = OrderedDict([
+        ('fps', ('gauge', 'Output framerate over the last {window}s.'.format(window=window), [])),
+        ('frames_total', ('counter', 'Frames out of the pipeline.', [])),
+        ('stage_latency_seconds', ('summary', 'Per-stage latency, quantiles over the last {window}s.'.format(
+            window=window), []))
+    ])
+
+    for metrics in metrics_list:
+        summary = metrics.summary()
+        labels = list(metrics.labels.items())
+
+        families['fps'][2].append(('', labels, summary['fps']))
+        families['frames_total'][2].append(('', labels, summary['frames']))
+
+        with metrics._lock:
+            totals = dict(metrics._totals)
+
+        samples = families['stage_latency_seconds'][2]
+        for stage, values in summary['stages'].items():
+            stage_labels = labels + [('stage', stage)]
+            for p in PERCENTILES:
+                value = values['percentiles'].get('p{p}'.format(p=p))
+                if value is not None:
+                    samples.append(('', stage_labels + [('quantile', p / 100)], value))
+            samples.append(('_sum', stage_labels, totals[stage][0]))
+            samples.append(('_count', stage_labels, totals[stage][1]))
+
+        for name, (description, _) in metrics._gauges.items():
+            families.setdefault(name, ('gauge', description, []))[2].append(('', labels, summary['gauges'][name]))
+
+    lines = []
+    for name, (kind, description, samples) in families.items():
+        lines += [
+            '# HELP {prefix}_{name} {description}'.format(prefix=prefix, name=name, description=description),
+            '# TYPE {prefix}_{name} {kind}'.format(prefix=prefix, name=name, kind=kind)
+        ]
+        for suffix, labels, value in samples:
+            lines.append('{prefix}_{name}{suffix}{labels} {value}'.format(
+                prefix=prefix, name=name, suffix=suffix, labels=format_labels(labels), value=value))
+
+    return '\n'.join(lines) + '\n'
+
+
+def dump_metrics(metrics_list, path):
+    """
+    Writes a snapshot of several pipeline metrics as JSON, keyed by their labels.
+    :param metrics_list: list of pipeline metrics.
+    :param path: output file path.
+    :return: void.
+    """
+    with open(path, 'w') as f:
+        json.dump([dict(metrics.summary(), labels=metrics.labels) for metrics in metrics_list], f, indent=2)
+
+
+class MetricsServer(object):
+    """
+    Class to serve metrics over HTTP in the Prometheus text format.
+    """
+
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        """
+        Binds the HTTP server.
+        :param metrics: pipeline metrics or list of pipeline metrics.
+        :param port: listening port.
+        :param host: listening address, local only by default.
+        """
+        metrics_list = metrics if isinstance(metrics, list) else [metrics]
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                """
+                Answers with the current metrics.
+                :return: void.
+                """
+                if self.path.rstrip('/') not in ('', '/metrics'):
+                    self.send_error(404)
+                    return
+
+                body = export_prometheus(metrics_list).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                """
+                Silences request logs.
+                :return: void.
+                """
+                pass
+
+        self.server = HTTPServer((host, port), Handler)
+
+    def start(self):
+        """
+        Starts serving on a daemon Thread.
+        :return: itself.
+        """
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving.
+        :return: void.
+        """
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Model utils file.
+    ======================
+    Collection of useful classes to run detection models through interchangeable inference backends.
+    Every backend returns the arrays of the frozen graph: normalized [ymin, xmin, ymax, xmax] boxes, scores, labelmap
+    classes as floats and number of detections, padded to DETECTION_CONFIG['max_detections'] rows per frame.
+    Runtimes are imported when a backend is created so that lighter backends don't load Tensorflow.
+"""
+
+import time
+
+from utils import *
+from collections import OrderedDict
+from server_utils import connect, decode_results, encode_frames, recv_message, send_message
+
+
+def load_frozen_graph(path=FROZEN_MODEL_PATH):
+    """
+    Loads a frozen Tensorflow model in memory.
+    :param path: frozen model path.
+    :return: Tensorflow graph.
+    """
+    import tensorflow as tf
+
+    detection_graph = tf.Graph()
+    with detection_graph.as_default():
+        od_graph_def = tf.GraphDef()
+        with tf.gfile.GFile(path, 'rb') as fid:
+            serialized_graph = fid.read()
+            od_graph_def.ParseFromString(serialized_graph)
+            tf.import_graph_def(od_graph_def, name='')
+    return detection_graph
+
+
+def session_config(intra_op_threads=None, inter_op_threads=None, cpu_only=False):
+    """
+    Builds a session configuration with explicit thread pools sizes.
+    :param intra_op_threads: threads used to run a single operation, Tensorflow default if not set.
+    :param inter_op_threads: threads used to run independent operations, Tensorflow default if not set.
+    :param cpu_only: hide GPUs from the session.
+    :return: Tensorflow session configuration.
+    """
+    import tensorflow as tf
+
+    return tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads or 0,
+                          inter_op_parallelism_threads=inter_op_threads or 0,
+                          device_count={'GPU': 0} if cpu_only else None)
+
+
+def optimize_frozen_graph(input_path=FROZEN_MODEL_PATH, output_path=OPTIMIZED_MODEL_PATH, input_shape=None,
+                          transforms=DETECTION_CONFIG['optimization']['transforms']):
+    """
+    Rewrites a frozen graph for inference: unused nodes are stripped, constants and batch normalizations are folded.
+    :param input_path: frozen model path.
+    :param output_path: optimized model path.
+    :param input_shape: fixed input shape (batch, height, width, channels), -1 leaves a dimension free, the input
+    shape is kept if not set.
+    :param transforms: Graph Transform Tool transforms applied after stripping unused nodes.
+    :return: number of nodes before and after the optimization.
+    """
+    import tensorflow as tf
+    from tensorflow.tools.graph_transforms import TransformGraph
+
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(input_path, 'rb') as fid:
+        graph_def.ParseFromString(fid.read())
+
+    input_name = DETECTION_CONFIG['input_tensor'].split(':')[0]
+    output_names = [name.split(':')[0] for name in DETECTION_CONFIG['output_tensors']]
+
+    strip = 'strip_unused_nodes(type=uint8{shape})'.format(
+        shape=', shape="{shape}"'.format(shape=','.join(str(size) for size in input_shape)) if input_shape else '')
+    optimized_def = TransformGraph(graph_def, [input_name], output_names, [strip] + list(transforms))
+
+    with tf.gfile.GFile(output_path, 'wb') as fid:
+        fid.write(optimized_def.SerializeToString())
+    return len(graph_def.node), len(optimized_def.node)
+
+
+def quantize_tflite_graph(graph_path, output_path, input_size, representative_images,
+                          config=DETECTION_CONFIG['backends']['tflite']):
+    """
+    Converts a TFLite-compatible frozen graph to a full-integer TFLite model, weights and activations are int8.
+    Activation ranges are calibrated on representative images. The detection postprocess stays a float custom op.
+    :param graph_path: graph exported by object_detection's export_tflite_ssd_graph.
+    :param output_path: TFLite model path.
+    :param input_size: model input size (width, height).
+    :param representative_images: function returning an iterator over BGR images.
+    :param config: TFLite backend configuration, float inputs are normalized the same way.
+    :return: void.
+    """
+    import tensorflow as tf
+
+    width, height = input_size
+    input_name = 'normalized_input_image_tensor'
+    converter = tf.lite.TFLiteConverter.from_frozen_graph(
+        graph_path, [input_name], ['TFLite_Detection_PostProcess'] + [
+            'TFLite_Detection_PostProcess:{index}'.format(index=index) for index in range(1, 4)],
+        input_shapes={input_name: [1, height, width, 3]})
+
+    def representative_dataset():
+        """
+        Yields calibration inputs, normalized like float model inputs.
+        :return: inputs generator.
+        """
+        for image in representative_images():
+            image = cv.resize(image, (width, height), interpolation=cv.INTER_LINEAR).astype(np.float32)
+            yield [((image - config['mean']) / config['std'])[np.newaxis]]
+
+    converter.allow_custom_ops = True
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.uint8
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def load_sample_images(dir=ROIS_PATH, count=DETECTION_CONFIG['optimization']['num_samples'], size=None):
+    """
+    Reads the first images of a dataset directory, used to measure models on real frames.
+    :param dir: images directory.
+    :param count: maximum number of images.
+    :param size: size (width, height) images are resized to, original sizes are kept if not set.
+    :return: list of images.
+    """
+    images = []
+    for path in sorted(list_files(dir, extensions=IMG_EXT))[:count]:
+        image = cv.imread(path)
+        if image is not None:
+            images.append(cv.resize(image, size, interpolation=cv.INTER_AREA) if size else image)
+    return images
+
+
+def measure_latency(model, images, warmup=DETECTION_CONFIG['optimization']['warmup']):
+    """
+    Measures the time a model takes to process images one at a time.
+    :param model: detection model.
+    :param images: input images.
+    :param warmup: number of untimed runs first, lazy allocations happen on the first runs.
+    :return: latency (s) of each image.
+    """
+    for image in images[:warmup]:
+        model.detect(image[np.newaxis])
+
+    latencies = []
+    for image in images:
+        start = time.time()
+        model.detect(image[np.newaxis])
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def pad_detections(boxes, scores, classes, size=DETECTION_CONFIG['max_detections']):
+    """
+    Sorts the detections of a frame by decreasing score and pads them with zeros to a fixed number of rows.
+    :param boxes: detected boxes.
+    :param scores: detection scores.
+    :param classes: detected classes.
+    :param size: number of rows.
+    :return: boxes, scores, classes and number of detections.
+    """
+    order = np.argsort(-scores, kind='stable')[:size]
+    count = len(order)
+
+    padded_boxes = np.zeros((size, 4), dtype=np.float32)
+    padded_scores = np.zeros(size, dtype=np.float32)
+    padded_classes = np.zeros(size, dtype=np.float32)
+    padded_boxes[:count], padded_scores[:count], padded_classes[:count] = boxes[order], scores[order], classes[order]
+    return padded_boxes, padded_scores, padded_classes, np.float32(count)
+
+
+def stack_detections(detections):
+    """
+    Stacks the padded detections of several frames into the arrays returned by detect.
+    :param detections: list of boxes, scores, classes and number of detections, one per frame.
+    :return: boxes, scores, classes and number of detections as numpy arrays, one row per frame.
+    """
+    return tuple(np.stack(arrays) for arrays in zip(*detections))
+
+
+class DetectionBackend(object):
+    """
+    Base class of inference backends.
+    """
+
+    # Whether a single instance may run frames from several threads at the same time.
+    thread_safe = False
+
+    def detect(self, images_np):
+        """
+        Runs the model on a batch of frames.
+        :param images_np: input frames stacked along the first axis.
+        :return: boxes, scores, classes and number of detections as numpy arrays, one row per frame.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Releases the backend resources.
+        :return: void.
+        """
+        pass
+
+
+class TensorflowBackend(DetectionBackend):
+    """
+    Class to run a frozen detection model through a precompiled session callable.
+    Tensors are resolved once so each call skips graph lookups and feed dict handling.
+    """
+
+    thread_safe = True
+
+    def __init__(self, path=FROZEN_MODEL_PATH, intra_op_threads=None, inter_op_threads=None, cpu_only=False):
+        """
+        Loads the model and builds the session callable.
+        :param path: frozen model path.
+        :param intra_op_threads: threads used to run a single operation.
+        :param inter_op_threads: threads used to run independent operations.
+        :param cpu_only: hide GPUs from the session.
+        """
+        import tensorflow as tf
+
+        self.graph = load_frozen_graph(path)
+        self.session = tf.Session(graph=self.graph, config=session_config(intra_op_threads, inter_op_threads,
+                                                                          cpu_only))
+
+        image_tensor = self.graph.get_tensor_by_name(DETECTION_CONFIG['input_tensor'])
+        fetches = [self.graph.get_tensor_by_name(name) for name in DETECTION_CONFIG['output_tensors']]
+        self._callable = self.session.make_callable(fetches, feed_list=[image_tensor])
+
+    def detect(self, images_np):
+        """
+        Runs the model on a batch of frames.
+        :param images_np: input frames stacked along the first axis.
+        :return: boxes, scores, classes and number of detections as numpy arrays, one row per frame.
+        """
+        return self._callable(images_np)
+
+    def close(self):
+        """
+        Releases the session.
+        :return: void.
+        """
+        self.session.close()
+
+
+class TFLiteBackend(DetectionBackend):
+    """
+    Class to run a TFLite detection model ending with the detection postprocess operation.
+    The lightweight tflite_runtime interpreter is used when installed, Tensorflow's otherwise.
+    """
+
+    def __init__(self, path=TFLITE_MODEL_PATH, intra_op_threads=None, inter_op_threads=None,
+                 config=DETECTION_CONFIG['backends']['tflite']):
+        """
+        Loads the model and allocates its tensors.
+        :param path: TFLite model path.
+        :param intra_op_threads: threads used by the interpreter.
+        :param inter_op_threads: unused, frames are run one after the other.
+        :param config: backend configuration, see DETECTION_CONFIG['backends']['tflite'].
+        """
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        # Older interpreters can't size their thread pool.
+        try:
+            self.interpreter = Interpreter(model_path=path, num_threads=intra_op_threads)
+        except TypeError:
+            self.interpreter = Interpreter(model_path=path)
+        self.interpreter.allocate_tensors()
+        self.config = config
+
+        self.input = self.interpreter.get_input_details()[0]
+        _, self.height, self.width, _ = self.input['shape']
+
+        # Postprocess outputs are named after the operation, suffixed by their index: boxes, classes, scores, count.
+        outputs = sorted(self.interpreter.get_output_details(), key=lambda output: output['name'])
+        self.outputs = [output['index'] for output in outputs[:3]]
+
+    def _prepare(self, image_np):
+        """
+        Resizes a frame to the model input and converts it to the input type.
+        :param image_np: input frame.
+        :return: input tensor.
+        """
+        if image_np.shape[:2] != (self.height, self.width):
+            image_np = cv.resize(image_np, (self.width, self.height), interpolation=cv.INTER_LINEAR)
+
+        if self.input['dtype'] == np.float32:
+            image_np = (image_np.astype(np.float32) - self.config['mean']) / self.config['std']
+        return image_np[np.newaxis].astype(self.input['dtype'], copy=False)
+
+    def detect(self, images_np):
+        """
+        Runs the model on a batch of frames, the interpreter runs them one after the other.
+        :param images_np: input frames stacked along the first axis.
+        :return: boxes, scores, classes and number of detections as numpy arrays, one row per frame.
+        """
+        detections = []
+        for image_np in images_np:
+            self.interpreter.set_tensor(self.input['index'], self._prepare(image_np))
+            self.interpreter.invoke()
+            boxes, classes, scores = (self.interpreter.get_tensor(index)[0] for index in self.outputs)
+            detections.append(pad_detections(np.clip(boxes, 0, 1), scores,
+                                             classes.astype(np.float32) + self.config['class_offset']))
+        return stack_detections(detections)
+
+
+class OpenCVBackend(DetectionBackend):
+    """
+    Class to run a frozen detection model through OpenCV's DNN module.
+    The frozen graph is read along with its text graph, generated by OpenCV's tf_text_graph_ssd.py.
+    """
+
+    def __init__(self, path=FROZEN_MODEL_PATH, intra_op_threads=None, inter_op_threads=None,
+                 config=DETECTION_CONFIG['backends']['opencv']):
+        """
+        Loads the network.
+        :param path: frozen model path.
+        :param intra_op_threads: threads used by OpenCV, which is a process-wide setting.
+        :param inter_op_threads: unused, layers are run one after the other.
+        :param config: backend configuration, see DETECTION_CONFIG['backends']['opencv'].
+        """
+        if intra_op_threads:
+            cv.setNumThreads(intra_op_threads)
+
+        self.net = cv.dnn.readNetFromTensorflow(path, config['config_path'])
+        self.config = config
+
+    def detect(self, images_np):
+        """
+        Runs the model on a batch of frames.
+        :param images_np: input frames stacked along the first axis.
+        :return: boxes, scores, classes and number of detections as numpy arrays, one row per frame.
+        """
+        blob = cv.dnn.blobFromImages(list(images_np), scalefactor=self.config['scale'], size=self.config['size'],
+                                     mean=self.config['mean'], swapRB=self.config['swap_rb'], crop=False)
+        self.net.setInput(blob)
+
+        # Rows of [image, class, score, xmin, ymin, xmax, ymax], classes already are labelmap ids.
+        rows = self.net.forward().reshape(-1, 7)
+        detections = []
+        for i in range(len(images_np)):
+            image_rows = rows[rows[:, 0] == i]
+            detections.append(pad_detections(np.clip(image_rows[:, [4, 3, 6, 5]], 0, 1).astype(np.float32),
+                                             image_rows[:, 2].astype(np.float32),
+                                             image_rows[:, 1].astype(np.float32)))
+        return stack_detections(detections)
+
+
+class RemoteBackend(DetectionBackend):
+    """
+    Class to send frames to the local inference server, which keeps a warm model for every client and batches their
+    frames together.
+    """
+
+    def __init__(self, path=INFERENCE_SERVER_ADDRESS, intra_op_threads=None, inter_op_threads=None,
+                 config=DETECTION_CONFIG['backends']['remote']):
+        """
+        Connects to the server.
+        :param path: server address, 'unix:path/to/socket' or 'tcp:host:port'.
+        :param intra_op_threads: unused, threads are set by the server.
+        :param inter_op_threads: unused, threads are set by the server.
+        :param config: backend configuration, see DETECTION_CONFIG['backends']['remote'].
+        """
+        self.address = path
+        self.config = config
+        self.socket = connect(path)
+
+    def detect(self, images_np):
+        """
+        Runs the model on a batch of frames.
+        :param images_np: input frames stacked along the first axis.
+        :return: boxes, scores, classes and number of detections as numpy arrays, one row per frame.
+        """
+        header, parts = encode_frames(images_np, self.config['encoding'], self.config['quality'])
+        send_message(self.socket, header, parts)
+
+        response = recv_message(self.socket)
+        if response is None:
+            raise IOError('Inference server {address} closed the connection.'.format(address=self.address))
+        header, payload = response
+        if 'error' in header:
+            raise IOError('Inference server {address} failed: {error}.'.format(address=self.address,
+                                                                               error=header['error']))
+        return decode_results(header, payload)
+
+    def close(self):
+        """
+        Closes the connection.
+        :return: void.
+        """
+        self.socket.close()
+
+
+# Available inference backends.
+BACKENDS = OrderedDict([
+    ('tensorflow', TensorflowBackend),
+    ('tflite', TFLiteBackend),
+    ('opencv', OpenCVBackend),
+    ('remote', RemoteBackend)
+])
+
+
+def create_model(backend=DETECTION_CONFIG['backend'], path=None, intra_op_threads=None, inter_op_threads=None):
+    """
+    Loads a detection model with the given inference backend.
+    :param backend: backend name, see BACKENDS.
+    :param path: model path, the backend configured path if not set.
+    :param intra_op_threads: threads used to run a single operation, runtime default if not set.
+    :param inter_op_threads: threads used to run independent operations, runtime default if not set.
+    :return: detection model.
+    """
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend {backend}.'.format(backend=backend))
+
+    return BACKENDS[backend](path or DETECTION_CONFIG['backends'][backend]['path'], intra_op_threads=intra_op_threads,
+                             inter_op_threads=inter_op_threads)
@@ -0,0 +1,811 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Pipeline utils file.
+    ======================
+    Collection of useful classes for the detection pipeline.
+"""
+
+import time
+import heapq
+import signal
+
+from utils import *
+from multiprocessing import Pool, Value
+from queue import Queue, Full, Empty
+from functools import partial
+from threading import Lock, Thread
+from collections import namedtuple, OrderedDict
+from model_utils import BACKENDS, create_model
+from multiprocessing.sharedctypes import RawArray
+
+# Frame sent to the detection workers, source is the index of the capture source, timestamp the capture time and
+# queued the admission time.
+FrameTask = namedtuple('FrameTask', ['source', 'seq', 'timestamp', 'queued', 'slot'])
+
+# Detections of a frame sent back by the detection workers, timings holds the seconds spent in each worker stage.
+FrameResult = namedtuple('FrameResult', ['source', 'seq', 'timestamp', 'slot', 'boxes', 'scores', 'classes',
+                                         'timings'])
+
+# Available admission policies.
+ADMISSION_POLICIES = ('block', 'drop-oldest', 'latest')
+
+# Available worker modes.
+WORKER_MODES = ('process', 'thread')
+
+
+class FrameRing(object):
+    """
+    Class to share fixed-size frame slots between the capture process and the detection workers.
+    Frames are written once in shared memory, only slot indices have to cross process boundaries.
+    """
+
+    def __init__(self, num_slots, shape, dtype=np.uint8):
+        """
+        Allocates the shared buffer, all slots are free.
+        :param num_slots: number of frames the buffer can hold.
+        :param shape: frame shape.
+        :param dtype: frame data type.
+        """
+        self.num_slots = num_slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slot_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.buffer = RawArray('B', num_slots * self.slot_size)
+
+        self._free = Queue()
+        for slot in range(num_slots):
+            self._free.put(slot)
+
+    def __getstate__(self):
+        """
+        Drops the free slots registry, slots are only acquired by the process which created the buffer.
+        :return: picklable state.
+        """
+        state = self.__dict__.copy()
+        state['_free'] = None
+        return state
+
+    def slot(self, index):
+        """
+        Returns a numpy view of a slot, no data is copied.
+        :param index: slot index.
+        :return: frame view.
+        """
+        return np.frombuffer(self.buffer, dtype=self.dtype, count=int(np.prod(self.shape)),
+                             offset=index * self.slot_size).reshape(self.shape)
+
+    def acquire(self, block=True, timeout=None):
+        """
+        Reserves a free slot.
+        :param block: wait for a slot to be released.
+        :param timeout: maximum waiting time in seconds.
+        :return: slot index.
+        """
+        return self._free.get(block=block, timeout=timeout)
+
+    def write(self, index, frame):
+        """
+        Copies a frame into a slot.
+        :param index: slot index.
+        :param frame: input frame.
+        :return: slot index.
+        """
+        np.copyto(self.slot(index), frame)
+        return index
+
+    def release(self, index):
+        """
+        Gives a slot back once its frame is no longer needed.
+        :param index: slot index.
+        :return: void.
+        """
+        self._free.put(index)
+
+
+class ReorderBuffer(object):
+    """
+    Class to put back in sequence order the frames returned by concurrent workers.
+    """
+
+    def __init__(self, deadline, first_seq=0):
+        """
+        Initializes an empty buffer.
+        :param deadline: maximum time in seconds a frame waits in the buffer for earlier ones before they are given up.
+        :param first_seq: sequence number of the first expected frame.
+        """
+        self.deadline = deadline
+        self.next_seq = first_seq
+        self.emitted = 0
+        self.dropped = 0
+        self._heap = []
+        self._pushed = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        """
+        Returns the number of frames waiting in the buffer.
+        :return: number of frames.
+        """
+        return len(self._heap)
+
+    def push(self, item, now=None, wait=True):
+        """
+        Adds a frame to the buffer.
+        :param item: frame with a seq attribute.
+        :param now: arrival time, defaults to time.time().
+        :param wait: whether the frame starts the deadline, frames which skipped the model are pushed when captured and
+        only wait for the frames in front of them.
+        :return: False if the frame arrived after it was given up, True otherwise.
+        """
+        with self._lock:
+            if item.seq < self.next_seq:
+                self.dropped += 1
+                return False
+
+            heapq.heappush(self._heap, (item.seq, item))
+            if wait:
+                self._pushed[item.seq] = time.time() if now is None else now
+            return True
+
+    def skip(self, seq):
+        """
+        Tells the buffer a frame will never arrive so that later frames don't wait for it.
+        :param seq: sequence number of the missing frame.
+        :return: void.
+        """
+        with self._lock:
+            if seq >= self.next_seq:
+                heapq.heappush(self._heap, (seq, None))
+
+    def pop(self, now=None):
+        """
+        Returns the frames ready to be emitted, in order.
+        Missing frames are skipped once the oldest waiting frame has waited longer than the deadline.
+        :param now: current time, defaults to time.time().
+        :return: list of frames.
+        """
+        ready = []
+        now = time.time() if now is None else now
+
+        with self._lock:
+            while self._heap:
+                seq, item = self._heap[0]
+                if seq != self.next_seq:
+                    # Skip markers and frames which skipped the model may sit in front of the frames, the deadline
+                    # applies to the earliest processed frame which arrived, from its arrival.
+                    if not self._pushed or now - self._pushed[min(self._pushed)] < self.deadline:
+                        break
+
+                heapq.heappop(self._heap)
+                self.next_seq = seq + 1
+
+                # Skipped frames only move the sequence forward.
+                if item is not None:
+                    self._pushed.pop(seq, None)
+                    ready.append(item)
+
+        self.emitted += len(ready)
+        return ready
+
+
+def put_latest(queue, item, on_drop=None):
+    """
+    Puts an item in a bounded queue without blocking, the oldest item is dropped if the queue is full.
+    :param queue: target queue.
+    :param item: item to add.
+    :param on_drop: function called with the dropped item.
+    :return: void.
+    """
+    while True:
+        try:
+            queue.put_nowait(item)
+            return
+        except Full:
+            try:
+                dropped = queue.get_nowait()
+            except Empty:
+                continue
+            if on_drop is not None:
+                on_drop(dropped)
+
+
+class AdmissionQueue(object):
+    """
+    Class to admit frames into the workers queue according to a policy and count dropped frames.
+    """
+
+    def __init__(self, queue, policy=DETECTION_CONFIG['admission_policy'], on_drop=None):
+        """
+        Wraps a bounded queue.
+        :param queue: workers queue.
+        :param policy: 'block' waits for room, 'drop-oldest' replaces the oldest queued frame when the queue is full,
+        'latest' replaces every queued frame.
+        :param on_drop: function called with each dropped frame.
+        """
+        if policy not in ADMISSION_POLICIES:
+            raise ValueError('Unknown admission policy {policy}.'.format(policy=policy))
+
+        self.queue = queue
+        self.policy = policy
+        self.on_drop = on_drop
+        self.admitted = 0
+        self.dropped = 0
+
+    def put(self, item):
+        """
+        Admits a frame.
+        :param item: frame to process.
+        :return: void.
+        """
+        if self.policy == 'block':
+            self.queue.put(item)
+        elif self.policy == 'drop-oldest':
+            put_latest(self.queue, item, on_drop=self._drop)
+        else:
+            # Stale frames are worthless, only the newest one waits for a worker.
+            while True:
+                try:
+                    self._drop(self.queue.get_nowait())
+                except Empty:
+                    break
+            put_latest(self.queue, item, on_drop=self._drop)
+        self.admitted += 1
+
+    def _drop(self, item):
+        """
+        Counts a dropped frame and notifies the owner.
+        :param item: dropped frame.
+        :return: void.
+        """
+        self.dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+
+def dispatch(source_queues, input_q, stop_event, ready):
+    """
+    Moves the admitted frames of several sources into the shared workers queue, taking one frame of each source in
+    turn so that a fast source can't starve the others.
+    :param source_queues: admitted frames of each source.
+    :param input_q: workers queue.
+    :param stop_event: event set when the program exits.
+    :param ready: semaphore released each time a frame is admitted.
+    :return: void.
+    """
+    while not stop_event.is_set():
+        moved = False
+        for source_q in source_queues:
+            try:
+                task = source_q.get_nowait()
+            except Empty:
+                continue
+
+            # Wait for room, without missing the program exit.
+            moved = True
+            while not stop_event.is_set():
+                try:
+                    input_q.put(task, timeout=.1)
+                    break
+                except Full:
+                    pass
+
+        if not moved:
+            ready.acquire(timeout=.1)
+
+
+class MotionGate(object):
+    """
+    Class to detect frames which changed enough since the last processed frame to be worth running the model on.
+    Frames are downscaled and converted to greyscale before being compared.
+    """
+
+    def __init__(self, config=DETECTION_CONFIG['motion']):
+        """
+        Initializes the gate without reference frame.
+        :param config: motion configuration, see DETECTION_CONFIG['motion'].
+        """
+        self.size = (config['width'], config['height'])
+        self.threshold = config['threshold']
+        self.min_area = config['min_area']
+        self.max_skipped = config['max_skipped']
+        self.reference = None
+        self.consecutive = 0
+        self.inferred = 0
+        self.skipped = 0
+
+    def changed(self, frame):
+        """
+        Compares a frame to the last processed one, the frame becomes the new reference if it changed.
+        :param frame: input frame.
+        :return: True if the model should run on the frame.
+        """
+        small = cv.cvtColor(cv.resize(frame, self.size, interpolation=cv.INTER_AREA), cv.COLOR_BGR2GRAY)
+
+        if self.reference is not None and self.consecutive < self.max_skipped:
+            changed_area = np.count_nonzero(cv.absdiff(small, self.reference) > self.threshold) / small.size
+            if changed_area < self.min_area:
+                self.consecutive += 1
+                self.skipped += 1
+                return False
+
+        self.reference = small
+        self.consecutive = 0
+        self.inferred += 1
+        return True
+
+    def reset(self):
+        """
+        Forgets the reference frame, e.g. when its detections will never be produced, the next frame is processed.
+        :return: void.
+        """
+        self.reference = None
+
+
+class DetectionSchedule(object):
+    """
+    Class to decide which frames are sent to the model when detections are tracked in between.
+    """
+
+    def __init__(self, config=DETECTION_CONFIG['tracking']):
+        """
+        Initializes the schedule, the first frame is always due.
+        :param config: tracking configuration, see DETECTION_CONFIG['tracking'].
+        """
+        self.every = max(1, config['detect_every'])
+        self.interval = config['detect_interval']
+        self.count = 0
+        self.last = None
+
+    def due(self, now=None):
+        """
+        Tells whether the model should run on the next frame.
+        :param now: current time, defaults to time.time().
+        :return: True if a detection is due.
+        """
+        now = time.time() if now is None else now
+        due = self.last is None or self.count % self.every == 0 or bool(
+            self.interval and now - self.last >= self.interval)
+
+        self.count += 1
+        if due:
+            self.count = 1
+            self.last = now
+        return due
+
+
+class BoxTracker(object):
+    """
+    Class to move the last detected boxes along the sparse optical flow of the following frames.
+    Boxes are normalized so the flow is computed on downscaled greyscale frames.
+    """
+
+    def __init__(self, min_score=SCORE_TRESH[DETECTION_CONFIG['default_thresh']], config=DETECTION_CONFIG['tracking']):
+        """
+        Initializes an empty tracker.
+        :param min_score: boxes with a lower score are carried forward without being tracked.
+        :param config: tracking configuration, see DETECTION_CONFIG['tracking'].
+        """
+        self.min_score = min_score
+        self.width = config['width']
+        self.grid = np.linspace(.2, .8, config['grid'], dtype=np.float32)
+        self.previous = None
+        self.boxes = self.scores = self.classes = None
+
+    def _prepare(self, frame):
+        """
+        Downscales a frame and converts it to greyscale.
+        :param frame: input frame.
+        :return: greyscale frame.
+        """
+        height = max(1, int(round(frame.shape[0] * self.width / frame.shape[1])))
+        return cv.cvtColor(cv.resize(frame, (self.width, height), interpolation=cv.INTER_AREA), cv.COLOR_BGR2GRAY)
+
+    def reset(self, frame, boxes, scores, classes):
+        """
+        Restarts tracking from fresh detections.
+        :param frame: frame the detections come from.
+        :param boxes: detected boxes.
+        :param scores: detection scores.
+        :param classes: detected classes.
+        :return: void.
+        """
+        self.previous = self._prepare(frame)
+        self.boxes, self.scores, self.classes = boxes.copy(), scores, classes
+
+    def update(self, frame):
+        """
+        Moves the tracked boxes to a new frame, each box follows the median displacement of its points.
+        :param frame: next frame.
+        :return: boxes, scores and classes.
+        """
+        if self.previous is None:
+            empty = np.zeros(0, dtype=np.float32)
+            return np.zeros((0, 4), dtype=np.float32), empty, empty
+
+        current = self._prepare(frame)
+        tracked = np.flatnonzero(self.scores >= self.min_score)
+
+        if len(tracked):
+            height, width = current.shape
+            ys, xs = np.meshgrid(self.grid, self.grid, indexing='ij')
+            boxes = self.boxes[tracked]
+
+            # Grid of points inside each box, in pixels.
+            points = np.stack([
+                (boxes[:, 1, None] + xs.ravel() * (boxes[:, 3, None] - boxes[:, 1, None])) * width,
+                (boxes[:, 0, None] + ys.ravel() * (boxes[:, 2, None] - boxes[:, 0, None])) * height
+            ], axis=-1).astype(np.float32)
+
+            moved, status, _ = cv.calcOpticalFlowPyrLK(self.previous, current, points.reshape(-1, 1, 2), None)
+            moved, status = moved.reshape(points.shape), status.reshape(points.shape[:2]).astype(bool)
+
+            for i, box in enumerate(tracked):
+                if status[i].any():
+                    dx, dy = np.median(moved[i][status[i]] - points[i][status[i]], axis=0)
+                    self.boxes[box] = np.clip(self.boxes[box] + [dy / height, dx / width, dy / height, dx / width],
+                                              0, 1)
+
+        self.previous = current
+        return self.boxes.copy(), self.scores, self.classes
+
+
+class HotModel(object):
+    """
+    Class to swap the model of a worker for a newly exported one without interrupting detections.
+    When the shared model version changes, the new model is loaded and warmed up in a background Thread while the
+    current one keeps serving, then requests switch over between two batches. Workers reload one at a time so that a
+    single extra model is in memory at any time.
+    """
+
+    def __init__(self, load, version, reload_lock):
+        """
+        Loads the current model.
+        :param load: function returning a new model.
+        :param version: shared model version, incremented to request a reload.
+        :param reload_lock: lock shared by the workers, held from the loading of a new model to the release of the
+        previous one.
+        """
+        self.load = load
+        self.version = version
+        self.reload_lock = reload_lock
+        self.loaded_version = version.value
+        self.model = load()
+        self.shape = None
+        self._pending = None
+        self._loading = False
+        self._users = {id(self.model): 0}
+        self._retired = None
+        self._lock = Lock()
+
+    def detect(self, images_np):
+        """
+        Runs the current model on a batch of frames, a pending model is swapped in first.
+        :param images_np: input frames stacked along the first axis.
+        :return: boxes, scores, classes and number of detections as numpy arrays, one row per frame.
+        """
+        with self._lock:
+            self.shape = images_np.shape[1:]
+            if self._pending is not None:
+                self._retired, self.model, self._pending = self.model, self._pending, None
+                self._users[id(self.model)] = 0
+                self._release(self._retired)
+            elif not self._loading and self.version.value != self.loaded_version:
+                self._loading = True
+                Thread(target=self._reload, args=(self.version.value, self.shape), daemon=True).start()
+
+            model = self.model
+            self._users[id(model)] += 1
+
+        try:
+            return model.detect(images_np)
+        finally:
+            with self._lock:
+                self._users[id(model)] -= 1
+                if model is self._retired:
+                    self._release(model)
+
+    def _release(self, model):
+        """
+        Closes a retired model once no request uses it anymore, other workers may then reload.
+        Must be called with the lock held.
+        :param model: retired model.
+        :return: void.
+        """
+        if self._users[id(model)]:
+            return
+
+        del self._users[id(model)]
+        self._retired = None
+        model.close()
+        self.reload_lock.release()
+
+    def _reload(self, version, shape):
+        """
+        Loads and warms up a new model, which is swapped in by the next batch.
+        :param version: requested model version.
+        :param shape: frame shape used to warm the model up.
+        :return: void.
+        """
+        self.reload_lock.acquire()
+        try:
+            start = time.time()
+            model = self.load()
+            model.detect(np.zeros((1,) + tuple(shape), dtype=np.uint8))
+        except Exception as ee:
+            print("Unable to reload the model: {error}.".format(error=ee))
+            self.reload_lock.release()
+            with self._lock:
+                self.loaded_version = version
+                self._loading = False
+            return
+
+        print("Model version {version} loaded in {seconds:.1f}s.".format(version=version, seconds=time.time() - start))
+        with self._lock:
+            self.loaded_version = version
+            self._pending = model
+            self._loading = False
+
+    def close(self):
+        """
+        Releases the current model.
+        :return: void.
+        """
+        self.model.close()
+
+
+def request_reload(version):
+    """
+    Asks every worker to reload its model.
+    :param version: shared model version.
+    :return: void.
+    """
+    with version.get_lock():
+        version.value += 1
+
+
+def watch_model(path, version, stop_event, interval=DETECTION_CONFIG['reload']['interval']):
+    """
+    Requests a reload each time the model file is replaced, once it stopped changing.
+    :param path: model path.
+    :param version: shared model version.
+    :param stop_event: event set when the program exits.
+    :param interval: polling interval in seconds.
+    :return: void.
+    """
+    def stat():
+        """
+        Returns the modification time and size of the model file.
+        :return: file state, None if the file is missing.
+        """
+        try:
+            info = os.stat(path)
+            return info.st_mtime, info.st_size
+        except OSError:
+            return None
+
+    current, candidate = stat(), None
+    while not stop_event.wait(interval):
+        latest = stat()
+        if latest is None or latest == current:
+            candidate = None
+        elif latest != candidate:
+            # The file may still be being written, wait for it to stay the same for an interval.
+            candidate = latest
+        else:
+            current, candidate = latest, None
+            print("{path} changed, reloading the model.".format(path=path))
+            request_reload(version)
+
+
+def detect_objects(images_np, model, max_boxes=DETECTION_CONFIG['max_boxes_to_draw']):
+    """
+    Detects objects on a list of frames.
+    :param images_np: input frames, all of the same size.
+    :param model: detection model.
+    :param max_boxes: number of boxes kept per frame, all boxes are kept if not set.
+    :return: boxes, scores and classes of each frame, in input order.
+    """
+    # Stack frames into a single batch, a single frame only needs a new axis.
+    batch = images_np[0][np.newaxis] if len(images_np) == 1 else np.stack(images_np)
+    (boxes, scores, classes, _) = model.detect(batch)
+
+    # Split results back per frame and only keep boxes that may be drawn.
+    max_boxes = max_boxes or None
+    return [(boxes[i][:max_boxes], scores[i][:max_boxes], classes[i][:max_boxes]) for i in range(len(images_np))]
+
+
+def get_batch(input_q, batch_size, timeout):
+    """
+    Waits for a frame then drains the queue until the batch is full or the timeout expires.
+    :param input_q: input queue.
+    :param batch_size: maximum number of frames.
+    :param timeout: maximum waiting time (ms) once the first frame is received.
+    :return: list of frames.
+    """
+    batch = [input_q.get()]
+    deadline = time.time() + timeout / 1000
+
+    while len(batch) < batch_size:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(input_q.get(timeout=remaining))
+        except Empty:
+            break
+    return batch
+
+
+def serve(model, input_q, output_q, frame_rings, batch_size=DETECTION_CONFIG['batch_size'],
+          batch_timeout=DETECTION_CONFIG['batch_timeout'], max_boxes=DETECTION_CONFIG['max_boxes_to_draw']):
+    """
+    Runs the model on queued frames forever.
+    :param model: detection model.
+    :param input_q: frames to process.
+    :param output_q: detections of the processed frames.
+    :param frame_rings: shared frames buffers, one per capture source.
+    :param batch_size: number of frames processed at once.
+    :param batch_timeout: maximum time (ms) to wait for a batch to fill.
+    :param max_boxes: number of boxes kept per frame.
+    :return: void.
+    """
+    while True:
+        tasks = get_batch(input_q, batch_size, batch_timeout)
+        picked = time.time()
+
+        # Frames of different sizes can't be stacked in the same batch.
+        batches = OrderedDict()
+        for task in tasks:
+            frame = frame_rings[task.source].slot(task.slot)
+            batches.setdefault(frame.shape, []).append((task, frame))
+
+        for batch in batches.values():
+            batch_tasks, frames = zip(*batch)
+            detections = detect_objects(frames, model, max_boxes)
+            inferred = time.time()
+
+            # Every frame of a batch waits for the whole batch.
+            for task, (boxes, scores, classes) in zip(batch_tasks, detections):
+                output_q.put(FrameResult(task.source, task.seq, task.timestamp, task.slot, boxes, scores, classes,
+                                         {'queue': picked - task.queued, 'inference': inferred - picked}))
+            picked = inferred
+
+
+def plan_cpus(num_workers, mode=DETECTION_CONFIG['worker_mode'], config=DETECTION_CONFIG['cpu']):
+    """
+    Splits the available cores between the capture thread and the detection workers.
+    When pinning and enough cores are available, the first core is kept for the capture thread.
+    :param num_workers: number of workers.
+    :param mode: worker mode.
+    :param config: CPU configuration, see DETECTION_CONFIG['cpu'].
+    :return: dictionary with the capture cores, the cores of each worker and the session thread pools sizes, the
+    largest intra-op pool and the one of each worker.
+    """
+    cores = list(config['cores'] or get_available_cores())
+    capture = cores[:1] if config['pin'] and len(cores) > num_workers else []
+    cores = cores[len(capture):]
+
+    if mode == 'process':
+        # Contiguous chunks, the first workers get the remaining cores, workers share cores only if there are less
+        # cores than workers.
+        if len(cores) >= num_workers:
+            size, remainder = divmod(len(cores), num_workers)
+            bounds = [i * size + min(i, remainder) for i in range(num_workers + 1)]
+            workers = [cores[bounds[i]:bounds[i + 1]] for i in range(num_workers)]
+        else:
+            workers = [[cores[i % len(cores)]] for i in range(num_workers)]
+        worker_threads = [len(chunk) for chunk in workers]
+        inter_op_threads = 1
+    else:
+        # A single session runs the requests of every worker thread.
+        workers = [cores] * num_workers
+        worker_threads = [len(cores)] * num_workers
+        inter_op_threads = num_workers
+
+    return {
+        'capture': capture,
+        'workers': workers if config['pin'] else [[] for _ in range(num_workers)],
+        'intra_op_threads': config['intra_op_threads'] or max(worker_threads),
+        'worker_intra_op_threads': [config['intra_op_threads'] or threads for threads in worker_threads],
+        'inter_op_threads': config['inter_op_threads'] or inter_op_threads
+    }
+
+
+def process_worker(input_q, output_q, frame_rings, options, cpu_plan, counter, backend, version=None,
+                   reload_lock=None):
+    """
+    Loads a detection model in memory and serves frames, entry point of worker processes.
+    :param input_q: frames to process.
+    :param output_q: detections of the processed frames.
+    :param frame_rings: shared frames buffers, one per capture source.
+    :param options: keyword arguments of serve.
+    :param cpu_plan: CPU allocation, see plan_cpus.
+    :param counter: shared counter giving each worker its index.
+    :param backend: inference backend, see model_utils.BACKENDS.
+    :param version: shared model version, the model is never reloaded if not set.
+    :param reload_lock: lock letting one worker at a time reload its model.
+    :return: void.
+    """
+    # Let the main process handle Ctrl+C and reload requests, a SIGHUP sent to every process by name would kill the
+    # workers otherwise.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+
+    # Pin before loading the model so that runtime threads inherit the affinity.
+    set_cpu_affinity(cpu_plan['workers'][index % len(cpu_plan['workers'])])
+    load = partial(create_model, backend,
+                   intra_op_threads=cpu_plan['worker_intra_op_threads'][index % len(cpu_plan['workers'])],
+                   inter_op_threads=cpu_plan['inter_op_threads'])
+    model = load() if version is None else HotModel(load, version, reload_lock)
+    serve(model, input_q, output_q, frame_rings, **options)
+
+
+def load_model(cpu_plan, backend=DETECTION_CONFIG['backend']):
+    """
+    Loads a detection model for worker threads.
+    The model is loaded from a Thread pinned to the workers cores so that runtime threads inherit the affinity.
+    :param cpu_plan: CPU allocation, see plan_cpus.
+    :param backend: inference backend, see model_utils.BACKENDS.
+    :return: detection model.
+    """
+    models = []
+
+    def load():
+        """
+        Pins the loading Thread and loads the model.
+        :return: void.
+        """
+        set_cpu_affinity(sorted(set(core for cores in cpu_plan['workers'] for core in cores)))
+        models.append(create_model(backend, intra_op_threads=cpu_plan['intra_op_threads'],
+                                   inter_op_threads=cpu_plan['inter_op_threads']))
+
+    loader = Thread(target=load)
+    loader.start()
+    loader.join()
+    return models[0]
+
+
+def start_workers(mode, num_workers, input_q, output_q, frame_rings, cpu_plan=None,
+                  backend=DETECTION_CONFIG['backend'], version=None, reload_lock=None, **options):
+    """
+    Starts the detection workers.
+    'process' loads one model per worker process, 'thread' shares a single model and session between worker threads
+    of the current process, which divides the model memory by the number of workers. Backends which can't run
+    concurrently get one model per worker thread.
+    :param mode: worker mode.
+    :param num_workers: number of workers.
+    :param input_q: frames to process, must be a multiprocessing queue in process mode.
+    :param output_q: detections of the processed frames, must be a multiprocessing queue in process mode.
+    :param frame_rings: shared frames buffers, one per capture source.
+    :param cpu_plan: CPU allocation, see plan_cpus, computed from DETECTION_CONFIG if not set.
+    :param backend: inference backend, see model_utils.BACKENDS.
+    :param version: shared model version, incrementing it makes the workers reload their model, see HotModel.
+    :param reload_lock: lock letting one worker at a time reload its model, required with version.
+    :param options: keyword arguments of serve.
+    :return: process pool, None in thread mode since worker threads end with the program.
+    """
+    if mode not in WORKER_MODES:
+        raise ValueError('Unknown worker mode {mode}.'.format(mode=mode))
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend {backend}.'.format(backend=backend))
+
+    if cpu_plan is None:
+        cpu_plan = plan_cpus(num_workers, mode)
+
+    if mode == 'process':
+        return Pool(num_workers, process_worker, (input_q, output_q, frame_rings, options, cpu_plan, Value('i', 0),
+                                                  backend, version, reload_lock))
+
+    # Session.run may be called concurrently, the graph is only loaded once.
+    load = partial(load_model, cpu_plan, backend)
+    if version is not None:
+        load = partial(HotModel, load, version, reload_lock)
+    model = load() if BACKENDS[backend].thread_safe else None
+    for _ in range(num_workers):
+        Thread(target=serve, args=(model or load(), input_q, output_q, frame_rings), kwargs=options,
+               daemon=True).start()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Profile utils file.
+    ======================
+    Collection of useful functions to persist the detection settings tuned for a machine.
+"""
+
+import json
+import socket
+import platform
+
+from utils import *
+
+# Settings stored in a profile, with the configuration value each one overrides.
+PROFILE_SETTINGS = {
+    'quality': (DEVICE_CONFIG, 'resolution'),
+    'num_workers': (DETECTION_CONFIG, 'num_workers'),
+    'queue_size': (DETECTION_CONFIG, 'queue_size'),
+    'intra_op_threads': (DETECTION_CONFIG['cpu'], 'intra_op_threads')
+}
+
+
+def get_profile_path(path=DETECTION_CONFIG['autotune']['profile_path']):
+    """
+    Returns the profile path of the current machine.
+    :param path: path pattern, {host} is replaced by the machine name.
+    :return: profile path.
+    """
+    return path.format(host=socket.gethostname())
+
+
+def describe_machine():
+    """
+    Describes the current machine, stored along with profiles.
+    :return: machine description as dictionary.
+    """
+    return {'host': socket.gethostname(), 'platform': platform.platform(), 'processor': platform.processor(),
+            'cores': len(get_available_cores()), 'memory': psutil.virtual_memory().total}
+
+
+def save_profile(settings, target, trials, path=None):
+    """
+    Writes a machine profile.
+    :param settings: selected settings, see PROFILE_SETTINGS.
+    :param target: objective the settings were selected for.
+    :param trials: measurements of every tried setting.
+    :param path: profile path, the current machine profile if not set.
+    :return: profile path.
+    """
+    path = path or get_profile_path()
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'w') as f:
+        json.dump({'machine': describe_machine(), 'date': get_current_datetime(format=True), 'target': target,
+                   'settings': settings, 'trials': trials}, f, indent=2)
+    return path
+
+
+def load_profile(path=None):
+    """
+    Applies the settings of a machine profile to the configuration, command line options still take precedence.
+    Must be called before default values are read from the configuration.
+    :param path: profile path, the current machine profile if not set.
+    :return: applied settings, None if there is no profile.
+    """
+    path = path or get_profile_path()
+    if not os.path.isfile(path):
+        return None
+
+    with open(path) as f:
+        settings = json.load(f)['settings']
+
+    for name, value in settings.items():
+        if name in PROFILE_SETTINGS and value is not None:
+            config, key = PROFILE_SETTINGS[name]
+            config[key] = value
+    return settings
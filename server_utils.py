@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Server utils file.
+    ======================
+    Collection of useful functions to talk to the local inference server.
+    Messages are a 4 bytes big-endian header length, a JSON header then an optional binary payload whose size is
+    given by the header.
+"""
+
+import json
+import struct
+import socket
+
+from utils import *
+
+# Header length prefix.
+HEADER_LENGTH = struct.Struct('!I')
+
+# Arrays returned for each frame, in payload order, with their type.
+RESULT_ARRAYS = (('boxes', np.float32), ('scores', np.float32), ('classes', np.float32), ('num', np.float32))
+
+# Available frame encodings, raw frames are sent as is, others are compressed by OpenCV.
+ENCODINGS = ('raw', 'jpeg', 'png')
+
+
+def parse_address(spec):
+    """
+    Parses a server address.
+    :param spec: 'unix:path/to/socket' or 'tcp:host:port'.
+    :return: socket family and address.
+    """
+    kind, _, target = spec.partition(':')
+
+    if kind == 'unix':
+        return socket.AF_UNIX, target
+    elif kind == 'tcp':
+        host, _, port = target.rpartition(':')
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    raise ValueError('Unknown server address {spec}.'.format(spec=spec))
+
+
+def connect(spec):
+    """
+    Opens a connection to the inference server.
+    :param spec: server address, see parse_address.
+    :return: connected socket.
+    """
+    family, address = parse_address(spec)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(address)
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def recv_exactly(sock, size):
+    """
+    Reads a given number of bytes.
+    :param sock: connected socket.
+    :param size: number of bytes.
+    :return: bytes, None if the connection was closed.
+    """
+    data = bytearray(size)
+    view = memoryview(data)
+    while size:
+        count = sock.recv_into(view[-size:], size)
+        if not count:
+            return None
+        size -= count
+    return data
+
+
+def send_message(sock, header, payload=b''):
+    """
+    Sends a message.
+    :param sock: connected socket.
+    :param header: JSON serializable dictionary, the payload size is added to it.
+    :param payload: bytes or list of bytes-like objects sent after the header.
+    :return: void.
+    """
+    payload = payload if isinstance(payload, list) else [payload]
+    header = json.dumps(dict(header, size=sum(memoryview(part).nbytes for part in payload))).encode('utf-8')
+    sock.sendall(HEADER_LENGTH.pack(len(header)) + header)
+    for part in payload:
+        sock.sendall(part)
+
+
+def recv_message(sock):
+    """
+    Receives a message.
+    :param sock: connected socket.
+    :return: header and payload, None if the connection was closed.
+    """
+    length = recv_exactly(sock, HEADER_LENGTH.size)
+    if length is None:
+        return None
+
+    header = recv_exactly(sock, HEADER_LENGTH.unpack(length)[0])
+    if header is None:
+        return None
+
+    header = json.loads(header.decode('utf-8'))
+    payload = recv_exactly(sock, header['size']) if header['size'] else bytearray()
+    return (header, payload) if payload is not None else None
+
+
+def encode_frames(images_np, encoding='raw', quality=90):
+    """
+    Builds a detection request.
+    :param images_np: input frames.
+    :param encoding: frame encoding, see ENCODINGS.
+    :param quality: JPEG quality.
+    :return: header and list of payload parts.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError('Unknown encoding {encoding}.'.format(encoding=encoding))
+
+    if encoding == 'raw':
+        parts = [np.ascontiguousarray(image_np) for image_np in images_np]
+        return {'encoding': encoding, 'shapes': [part.shape for part in parts],
+                'sizes': [part.nbytes for part in parts]}, parts
+
+    params = [cv.IMWRITE_JPEG_QUALITY, quality] if encoding == 'jpeg' else []
+    parts = [cv.imencode('.' + encoding, image_np, params)[1] for image_np in images_np]
+    return {'encoding': encoding, 'sizes': [part.nbytes for part in parts]}, parts
+
+
+def decode_frames(header, payload):
+    """
+    Reads the frames of a detection request.
+    :param header: request header.
+    :param payload: request payload.
+    :return: list of frames.
+    """
+    frames, offset = [], 0
+    for i, size in enumerate(header['sizes']):
+        data = np.frombuffer(payload, dtype=np.uint8, count=size, offset=offset)
+        offset += size
+
+        if header['encoding'] == 'raw':
+            frames.append(data.reshape(header['shapes'][i]))
+        else:
+            frames.append(cv.imdecode(data, cv.IMREAD_COLOR))
+    return frames
+
+
+def encode_results(detections):
+    """
+    Builds a detection response.
+    :param detections: boxes, scores, classes and number of detections of each frame.
+    :return: header and list of payload parts.
+    """
+    arrays = [np.stack([detection[i] for detection in detections]).astype(dtype, copy=False)
+              for i, (_, dtype) in enumerate(RESULT_ARRAYS)]
+    return {'shapes': [array.shape for array in arrays]}, [np.ascontiguousarray(array) for array in arrays]
+
+
+def decode_results(header, payload):
+    """
+    Reads a detection response.
+    :param header: response header.
+    :param payload: response payload.
+    :return: boxes, scores, classes and number of detections as numpy arrays, one row per frame.
+    """
+    arrays, offset = [], 0
+    for shape, (_, dtype) in zip(header['shapes'], RESULT_ARRAYS):
+        count = int(np.prod(shape))
+        arrays.append(np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape))
+        offset += count * np.dtype(dtype).itemsize
+    return tuple(arrays)
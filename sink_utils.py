@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Sink utils file.
+    ======================
+    Collection of detection sinks for headless detections.
+"""
+
+import json
+import time
+import socket
+
+from utils import *
+
+
+class DetectionSink(object):
+    """
+    Base class of the detection sinks, receives the detections of each frame in capture order.
+    """
+
+    def write(self, record):
+        """
+        Writes the detections of a frame.
+        :param record: frame detections as dictionary.
+        :return: void.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Releases the sink resources.
+        :return: void.
+        """
+        pass
+
+    @staticmethod
+    def serialize(record):
+        """
+        Serializes a record as a JSON line, numpy scalars are converted to floats.
+        :param record: frame detections as dictionary.
+        :return: JSON line as string.
+        """
+        return json.dumps(record, default=float) + '\n'
+
+
+class JsonLinesSink(DetectionSink):
+    """
+    Class to append detections to a JSON lines file.
+    """
+
+    def __init__(self, path):
+        """
+        Opens the output file.
+        :param path: file path.
+        """
+        self.file = open(path, 'a')
+
+    def write(self, record):
+        """
+        Appends the detections of a frame as a new line.
+        :param record: frame detections as dictionary.
+        :return: void.
+        """
+        self.file.write(self.serialize(record))
+
+    def close(self):
+        """
+        Closes the output file.
+        :return: void.
+        """
+        self.file.close()
+
+
+class UnixSocketSink(DetectionSink):
+    """
+    Class to stream detections as JSON lines to a listening Unix domain socket.
+    """
+
+    def __init__(self, path, config=DETECTION_CONFIG['socket_sink']):
+        """
+        Connects to the socket.
+        :param path: socket path.
+        :param config: sink configuration, see DETECTION_CONFIG['socket_sink'].
+        """
+        self.path = path
+        self.config = config
+        self.socket = None
+        self.retry_delay = config['retry_min']
+        self.retry_time = 0
+        self.dropped = 0
+        self.connect()
+
+    def connect(self):
+        """
+        Opens a new connection, detections are dropped while the listener is unreachable.
+        Attempts are spaced out exponentially and only the first failure of an outage is logged.
+        :return: void.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.config['send_timeout'])
+            sock.connect(self.path)
+        except OSError as ee:
+            sock.close()
+            if self.retry_delay == self.config['retry_min']:
+                print("Unable to connect to socket {path} : {error}, detections are dropped until it is back.".format(
+                    path=self.path, error=ee))
+            self.retry_time = time.time() + self.retry_delay
+            self.retry_delay = min(self.retry_delay * 2, self.config['retry_max'])
+            return
+
+        if self.dropped:
+            print("Reconnected to socket {path}, {dropped} detections dropped.".format(
+                path=self.path, dropped=self.dropped))
+        self.socket = sock
+        self.retry_delay = self.config['retry_min']
+        self.dropped = 0
+
+    def write(self, record):
+        """
+        Sends the detections of a frame, reconnects if the listener went away.
+        A listener which stops reading gets disconnected after the send timeout instead of stalling the pipeline.
+        :param record: frame detections as dictionary.
+        :return: void.
+        """
+        if self.socket is None and time.time() >= self.retry_time:
+            self.connect()
+        if self.socket is None:
+            self.dropped += 1
+            return
+
+        try:
+            self.socket.sendall(self.serialize(record).encode('utf-8'))
+        except OSError as ee:
+            # A timed out send may have written part of the line, the connection can't be reused.
+            print("Socket {path} disconnected : {error}.".format(path=self.path, error=ee))
+            self.dropped += 1
+            self.close()
+
+    def close(self):
+        """
+        Closes the connection.
+        :return: void.
+        """
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+class CallbackSink(DetectionSink):
+    """
+    Class to hand detections to a function, e.g. list.append to keep them in memory.
+    """
+
+    def __init__(self, callback):
+        """
+        Stores the callback.
+        :param callback: function called with each record.
+        """
+        self.callback = callback
+
+    def write(self, record):
+        """
+        Calls the callback with the detections of a frame.
+        :param record: frame detections as dictionary.
+        :return: void.
+        """
+        self.callback(record)
+
+
+def create_sink(spec):
+    """
+    Creates a sink from its specification.
+    :param spec: 'jsonl:path/to/file.jsonl' or 'unix:path/to/socket'.
+    :return: detection sink.
+    """
+    kind, _, target = spec.partition(':')
+
+    if kind == 'jsonl':
+        return JsonLinesSink(target)
+    elif kind == 'unix':
+        return UnixSocketSink(target)
+    raise ValueError('Unknown sink {spec}.'.format(spec=spec))
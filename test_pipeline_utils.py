@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Pipeline utils tests.
+    ======================
+    Run with pytest.
+"""
+
+from pipeline_utils import FrameResult, ReorderBuffer
+
+
+def make_result(seq, timestamp):
+    """
+    Builds the detections of a frame.
+    :param seq: frame sequence number.
+    :param timestamp: capture time.
+    :return: frame detections.
+    """
+    return FrameResult(0, seq, timestamp, seq, None, None, None, {})
+
+
+def test_reorder_waits_for_missing_frame():
+    """
+    Frames wait for a missing earlier frame until the deadline.
+    :return: void.
+    """
+    buffer = ReorderBuffer(deadline=.25)
+    buffer.push(make_result(1, 10.), now=10.)
+
+    assert buffer.pop(now=10.1) == []
+    assert [result.seq for result in buffer.pop(now=10.3)] == [1]
+
+
+def test_reorder_deadline_behind_skip_marker():
+    """
+    The deadline still applies to frames queued behind a skip marker.
+    :return: void.
+    """
+    # Frame 0 is lost, frame 1 was dropped by the admission policy and frame 2 arrived.
+    buffer = ReorderBuffer(deadline=.25)
+    buffer.skip(1)
+    buffer.push(make_result(2, 10.), now=10.)
+
+    assert buffer.pop(now=10.1) == []
+    assert [result.seq for result in buffer.pop(now=10.3)] == [2]
+    assert buffer.next_seq == 3
+    assert not len(buffer)
+
+
+def test_reorder_deadline_from_arrival():
+    """
+    Frames which took longer than the deadline to be processed still wait for earlier ones.
+    :return: void.
+    """
+    buffer = ReorderBuffer(deadline=.25)
+    buffer.push(make_result(1, 10.), now=10.4)
+
+    assert buffer.pop(now=10.5) == []
+    buffer.push(make_result(0, 9.9), now=10.6)
+    assert [result.seq for result in buffer.pop(now=10.6)] == [0, 1]
+
+
+def test_reorder_skipped_frames_wait_for_detections():
+    """
+    Frames which skipped the model never give up the detected frame in front of them.
+    :return: void.
+    """
+    buffer = ReorderBuffer(deadline=.25)
+    for seq in range(1, 5):
+        buffer.push(make_result(seq, 10. + seq / 30), now=10. + seq / 30, wait=False)
+
+    assert buffer.pop(now=11.) == []
+    buffer.push(make_result(0, 10.), now=11.)
+    assert [result.seq for result in buffer.pop(now=11.)] == [0, 1, 2, 3, 4]
@@ -75,3 +75,25 @@ class RotatingRecord(object):
         :return: filename as string.
         """
         return os.path.join(self.directory, TFRECORD_CONFIG[self.purpose].format(id=self.ii))
+
+
+def read_record_images(purpose='test', directory=TFRECORDS_DIR, count=None):
+    """
+    Streams the images of TFRecord files, decoded as BGR frames like camera frames.
+    :param purpose: record type.
+    :param directory: TFRecord files directory.
+    :param count: maximum number of images, all images are read if not set.
+    :return: images generator.
+    """
+    read = 0
+    for path in sorted(tf.gfile.Glob(os.path.join(directory, TFRECORD_CONFIG[purpose].format(id='*')))):
+        for record in tf.python_io.tf_record_iterator(path):
+            if count is not None and read >= count:
+                return
+
+            example = tf.train.Example.FromString(record)
+            encoded = example.features.feature['image/encoded'].bytes_list.value[0]
+            image = cv.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv.IMREAD_COLOR)
+            if image is not None:
+                read += 1
+                yield image
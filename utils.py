@@ -8,12 +8,14 @@
 
 import re
 import pytz
+import psutil
 import random
 import numpy as np
 import skimage as sk
 
 from config import *
 from PIL import Image
+from queue import Empty
 from datetime import datetime
 from collections import namedtuple
 from pkg_resources import parse_version
@@ -21,6 +23,10 @@ from skimage import exposure, filters, transform, util
 
 augmentation_config = TRANSFORMATION_CONFIG
 
+# Detections of a frame as a compact structured array.
+DETECTION_DTYPE = np.dtype([('class_id', np.int32), ('score', np.float32), ('ymin', np.float32),
+                            ('xmin', np.float32), ('ymax', np.float32), ('xmax', np.float32)])
+
 
 def random_name(chars, size, use_date=True, date_pattern=DATE_FORMAT):
     """
@@ -176,6 +182,160 @@ def get_prop_id(property):
     return getattr(cv if OPCV3 else cv.cv, ('' if OPCV3 else 'CV_') + 'CAP_PROP_' + property)
 
 
+def get_available_cores():
+    """
+    Returns the CPU cores the current process may run on.
+    :return: sorted list of core identifiers.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def set_cpu_affinity(cores):
+    """
+    Pins the calling thread to the specified cores, only supported on Linux.
+    Threads created afterwards by the calling thread inherit the affinity.
+    :param cores: core identifiers, nothing is done if empty.
+    :return: True if the affinity was set.
+    """
+    if not cores or not hasattr(os, 'sched_setaffinity'):
+        return False
+    os.sched_setaffinity(0, cores)
+    return True
+
+
+def memory_usage():
+    """
+    Returns the memory used by the current process and its children.
+    Proportional set size is used when available so that pages shared after fork are not counted twice.
+    :return: memory in bytes.
+    """
+    total = 0
+    current = psutil.Process()
+    for process in [current] + current.children(recursive=True):
+        try:
+            info = process.memory_full_info()
+            total += getattr(info, 'pss', info.rss)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return total
+
+
+def wait_report(process, report_q, default):
+    """
+    Waits for the report of a measurement process.
+    :param process: measurement process.
+    :param report_q: queue receiving the report.
+    :param default: fields of the error report returned if the process died without reporting.
+    :return: report.
+    """
+    while True:
+        try:
+            return report_q.get(timeout=1)
+        except Empty:
+            if process.is_alive():
+                continue
+
+        # The report may have been queued right before the process exited.
+        try:
+            return report_q.get(timeout=1)
+        except Empty:
+            return dict(default, error="Process exited with code {code}.".format(code=process.exitcode))
+
+
+def get_detection_array(boxes, classes, scores, min_score_thresh, max_boxes=None):
+    """
+    Returns the items detected on a frame as a structured array, see DETECTION_DTYPE.
+    :param boxes: detected boxes as (ymin, xmin, ymax, xmax).
+    :param classes: detected classes.
+    :param scores: detection scores, every box is kept if None.
+    :param min_score_thresh: boxes with a lower or equal score are ignored.
+    :param max_boxes: only the first boxes are considered, all boxes if not set.
+    :return: structured array of detections.
+    """
+    count = min(max_boxes, boxes.shape[0]) if max_boxes else boxes.shape[0]
+    boxes, classes = boxes[:count], classes[:count]
+
+    if scores is None:
+        scores = np.ones(count, dtype=np.float32)
+        mask = np.ones(count, dtype=bool)
+    else:
+        scores = scores[:count]
+        mask = scores > min_score_thresh
+
+    detections = np.empty(np.count_nonzero(mask), dtype=DETECTION_DTYPE)
+    detections['class_id'] = classes[mask]
+    detections['score'] = scores[mask]
+    for i, coord in enumerate(('ymin', 'xmin', 'ymax', 'xmax')):
+        detections[coord] = boxes[mask, i]
+    return detections
+
+
+def detection_array_to_dicts(detections, category_index):
+    """
+    Converts a structured array of detections to dictionaries.
+    :param detections: structured array of detections, see DETECTION_DTYPE.
+    :param category_index: labelmap categories by ID.
+    :return: list of detections as dictionaries.
+    """
+    return [
+        {
+            'class': str(category_index[class_id]['name']) if class_id in category_index else 'N/A',
+            'confidence': round(score, 2),
+            'box': {
+                'xmin': xmin,
+                'ymin': ymin,
+                'xmax': xmax,
+                'ymax': ymax
+            }
+        } for class_id, score, ymin, xmin, ymax, xmax in detections.tolist()
+    ]
+
+
+def detection_iou(first, second):
+    """
+    Computes the intersection over union of every pair of detections.
+    :param first: structured array of detections, see DETECTION_DTYPE.
+    :param second: structured array of detections, see DETECTION_DTYPE.
+    :return: matrix of overlaps, one row per detection of first.
+    """
+    ymin = np.maximum(first['ymin'][:, None], second['ymin'][None])
+    xmin = np.maximum(first['xmin'][:, None], second['xmin'][None])
+    ymax = np.minimum(first['ymax'][:, None], second['ymax'][None])
+    xmax = np.minimum(first['xmax'][:, None], second['xmax'][None])
+    intersection = np.clip(ymax - ymin, 0, None) * np.clip(xmax - xmin, 0, None)
+
+    first_area = (first['ymax'] - first['ymin']) * (first['xmax'] - first['xmin'])
+    second_area = (second['ymax'] - second['ymin']) * (second['xmax'] - second['xmin'])
+    union = first_area[:, None] + second_area[None] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-12), 0)
+
+
+def detection_agreement(reference, candidate, iou_thresh=.5):
+    """
+    Measures how well detections agree with reference detections, each reference detection greedily matches the most
+    overlapping unmatched candidate of the same class.
+    :param reference: structured array of reference detections, see DETECTION_DTYPE.
+    :param candidate: structured array of compared detections, see DETECTION_DTYPE.
+    :param iou_thresh: minimum overlap of matching detections.
+    :return: F1 score of the matches, 1 when both are empty.
+    """
+    if not len(reference) and not len(candidate):
+        return 1.
+
+    overlaps = detection_iou(reference, candidate)
+    overlaps[reference['class_id'][:, None] != candidate['class_id'][None]] = 0
+
+    matched = 0
+    for i in np.argsort(-reference['score'], kind='stable'):
+        j = np.argmax(overlaps[i]) if len(candidate) else None
+        if j is not None and overlaps[i, j] >= iou_thresh:
+            overlaps[:, j] = 0
+            matched += 1
+    return 2 * matched / (len(reference) + len(candidate))
+
+
 def get_detection_boxes(boxes, classes, scores, category_index, tresh_level,
                         max_boxes_to_draw=DETECTION_CONFIG['max_boxes_to_draw']):
     """
@@ -188,36 +348,8 @@ def get_detection_boxes(boxes, classes, scores, category_index, tresh_level,
     :param max_boxes_to_draw:
     :return:
     """
-    detections = []
-
-    min_score_thresh = SCORE_TRESH[tresh_level]
-
-    if not max_boxes_to_draw:
-        max_boxes_to_draw = boxes.shape[0]
-
-    for i in range(min(max_boxes_to_draw, boxes.shape[0])):
-        if scores is None or scores[i] > min_score_thresh:
-            class_name = 'N/A'
-            ymin, xmin, ymax, xmax = boxes[i].tolist()
-            confidence = round(scores[i], 2)
-
-            if classes[i] in category_index.keys():
-                class_name = category_index[classes[i]]['name']
-            class_name = str(class_name)
-
-            detections.append(
-                {
-                    'class': class_name,
-                    'confidence': confidence,
-                    'box': {
-                        'xmin': xmin,
-                        'ymin': ymin,
-                        'xmax': xmax,
-                        'ymax': ymax
-                    }
-                }
-            )
-    return detections
+    return detection_array_to_dicts(get_detection_array(boxes, classes, scores, SCORE_TRESH[tresh_level],
+                                                        max_boxes_to_draw), category_index)
 
 
 def find_latest_checkpoint(dir, prefix):